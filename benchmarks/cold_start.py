@@ -0,0 +1,66 @@
+"""
+Cold Start Benchmark
+
+Measures how long a fresh interpreter takes to import the service and to
+answer its first request, which is what every gunicorn worker boot and
+every test run pays. Each sample runs in a new subprocess, after the
+tables were created once with "flask db-create".
+
+    python -m benchmarks.cold_start --runs 20
+    DATABASE_URI=postgres://... python -m benchmarks.cold_start --output cold.json
+
+Without DATABASE_URI a temporary SQLite file is used.
+"""
+import os
+import sys
+import json
+import tempfile
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Prints the import time and the time to the first response, in milliseconds
+PROBE = """
+import time
+start = time.perf_counter()
+from service import app
+imported = time.perf_counter()
+app.test_client().get("/wishlists?limit=1")
+answered = time.perf_counter()
+print((imported - start) * 1000, (answered - start) * 1000)
+"""
+
+
+def sample(env):
+    """ Runs the probe once in a new interpreter """
+    output = subprocess.check_output([sys.executable, "-c", PROBE], cwd=ROOT, env=env, stderr=subprocess.DEVNULL)
+    imported, answered = output.decode().split()
+    return float(imported), float(answered)
+
+
+def main(argv=None):
+    """ Samples the cold start and prints the medians """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--output", help="write the samples as JSON to this file")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, FLASK_APP="service:app")
+    env.setdefault("DATABASE_URI", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "cold_start.db"))
+    subprocess.check_call([sys.executable, "-m", "flask", "db-create"], cwd=ROOT, env=env)
+    samples = [sample(env) for _ in range(args.runs)]
+    imports = [imported for imported, _ in samples]
+    firsts = [answered for _, answered in samples]
+    print("import          median {:8.1f} ms  max {:8.1f} ms".format(statistics.median(imports), max(imports)))
+    print("first response  median {:8.1f} ms  max {:8.1f} ms".format(statistics.median(firsts), max(firsts)))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"import_ms": imports, "first_response_ms": firsts}, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Sync vs Cooperative Benchmark
+
+Runs the HTTP load benchmark twice against the same seeded database: once
+with gunicorn's sync workers serving service:app and once with its gevent
+workers serving cooperative:app, then compares the two side by side.
+
+A local database answers too quickly for waiting to matter, so
+--db-latency-ms adds a sleep before every SQL statement in the server to
+stand in for the round trip to a remote PostgreSQL. The sleep is
+cooperative under gevent, just like a patched socket read.
+
+    python -m benchmarks.cooperative --db-latency-ms 20 --concurrency 200
+    DATABASE_URI=postgres://... python -m benchmarks.cooperative --workers 2
+
+Only read routes are driven unless --only is given: SQLite locks the whole
+file for writes, so concurrent writers measure the lock and not the mode.
+Other arguments are passed on to benchmarks.http_load.
+"""
+import os
+import sys
+import json
+import tempfile
+import argparse
+
+from benchmarks import http_load
+
+READ_ROUTES = ("list_wishlists", "get_wishlist", "list_items", "get_item")
+
+# Installs the simulated database latency, then runs gunicorn
+SERVER = (
+    "import time, sqlalchemy.event, sqlalchemy.engine; "
+    "sqlalchemy.event.listen(sqlalchemy.engine.Engine, 'before_cursor_execute', "
+    "lambda *args: time.sleep({delay})); "
+    "from gunicorn.app.wsgiapp import run; run()"
+)
+
+MODES = (
+    ("sync", ["--worker-class", "sync"], "service:app"),
+    ("gevent", ["--worker-class", "gevent", "--worker-connections", "1000"], "cooperative:app"),
+)
+
+
+def server_command(delay, worker_args, app_module):
+    """ Returns a server factory for http_load.main() """
+    def command(port, workers):
+        return [
+            sys.executable, "-c", SERVER.format(delay=delay),
+            "--workers", str(workers), *worker_args,
+            "--bind", "127.0.0.1:{}".format(port), "--log-level", "warning", app_module,
+        ]
+    return command
+
+
+def main(argv=None):
+    """ Benchmarks both modes and prints the comparison """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db-latency-ms", type=float, default=0, help="simulated delay per SQL statement")
+    parser.add_argument("--output", help="write both runs as JSON to this file")
+    args, passed_on = parser.parse_known_args(argv)
+    if "--only" not in passed_on:
+        for route in READ_ROUTES:
+            passed_on += ["--only", route]
+
+    runs = {}
+    with tempfile.TemporaryDirectory() as path:
+        for mode, worker_args, app_module in MODES:
+            print("== {} ({})".format(mode, app_module))
+            output = os.path.join(path, mode + ".json")
+            command = server_command(args.db_latency_ms / 1000, worker_args, app_module)
+            http_load.main(passed_on + ["--output", output], server_command=command)
+            with open(output) as run:
+                runs[mode] = json.load(run)
+
+    sync, cooperative = runs["sync"]["results"], runs["gevent"]["results"]
+    print("{:<26} {:>12} {:>12} {:>12} {:>12}".format(
+        "route", "sync req/s", "gevent req/s", "sync p99", "gevent p99"))
+    for route in sync:
+        print("{:<26} {:>12} {:>12} {:>12} {:>12}".format(
+            route, sync[route]["requests_per_second"], cooperative[route]["requests_per_second"],
+            sync[route]["p99_ms"], cooperative[route]["p99_ms"]))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"db_latency_ms": args.db_latency_ms, "runs": runs}, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
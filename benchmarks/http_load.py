@@ -0,0 +1,414 @@
+"""
+HTTP Load Benchmark
+
+Seeds a database with the test factories, starts the service against it
+and drives every route with concurrent clients. For each route it reports
+p50/p95/p99 latency and requests per second, and it can write everything
+to a JSON file so runs can be compared across commits.
+
+Run it from the project root, e.g.:
+
+    python -m benchmarks.http_load --wishlists 10000 --items 50 --output run.json
+    DATABASE_URI=postgres://... python -m benchmarks.http_load --workers 4
+    python -m benchmarks.http_load --url http://localhost:5000 --no-seed
+
+Without DATABASE_URI a temporary SQLite file is used. Unless --url is
+given, the service is started under gunicorn (or the werkzeug server when
+gunicorn is not installed) with the same DATABASE_URI. A server given with
+--url must use the database this script seeds. DELETE /wishlists/reset
+would wipe the seeded data, so it is only timed, once, after every other
+route and only with --reset.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+if "DATABASE_URI" not in os.environ:
+    os.environ["DATABASE_URI"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "http_load.db")
+
+from service import app  # pylint: disable=wrong-import-position
+from service.models import db, Wishlist, Item, Share, Rollup  # pylint: disable=wrong-import-position
+from service.commands import reset_sequences  # pylint: disable=wrong-import-position
+from tests.factories import WishlistFactory, ItemFactory  # pylint: disable=wrong-import-position
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Rows inserted per statement while seeding
+SEED_CHUNK = 5000
+
+
+######################################################################
+#  S E E D I N G
+######################################################################
+class Layout():
+    """
+    Where the seeded rows are, so every scenario can pick valid ids
+
+    Wishlists 1..W hold I items each (item ids (w - 1) * I + 1 .. w * I).
+    The next R wishlists are empty and get deleted by delete_wishlist, and
+    the one after them holds the R items deleted by delete_item.
+    """
+
+    def __init__(self, wishlists, items, reserved):
+        self.wishlists = wishlists
+        self.items = items
+        self.reserved = reserved
+        self.scratch_wishlist = wishlists + reserved + 1
+
+    def random_wishlist(self):
+        return random.randint(1, self.wishlists)
+
+    def random_item(self):
+        """ Returns (wishlist id, item id) of a random seeded item """
+        wishlist_id = self.random_wishlist()
+        return wishlist_id, (wishlist_id - 1) * self.items + random.randint(1, self.items)
+
+    def spare_wishlist(self, n):
+        return self.wishlists + 1 + n
+
+    def spare_item(self, n):
+        return self.wishlists * self.items + 1 + n
+
+
+def wishlist_row(wishlist_id):
+    """ Builds a wishlist row from the factory, with its recipients in shared_with """
+    fake = WishlistFactory()
+    return {
+        "id": wishlist_id,
+        "name": fake.name,
+        "email": fake.email,
+        "shared_with": fake.shared_with,
+        # every other wishlist is public, for /search
+        "shared": wishlist_id % 2 == 0,
+    }
+
+
+def share_rows(wishlists):
+    """ Moves the shared_with list of each wishlist row into share rows """
+    for wishlist in wishlists:
+        for position, email in enumerate(wishlist.pop("shared_with"), 1):
+            yield {"wishlist_id": wishlist["id"], "position": position, "email": email}
+
+
+def item_row(item_id, wishlist_id):
+    """ Builds an item row from the factory """
+    fake = ItemFactory()
+    return {
+        "id": item_id,
+        "wishlist_id": wishlist_id,
+        "name": fake.name,
+        "sku": fake.sku,
+        "description": fake.description,
+        "quantity": fake.quantity,
+    }
+
+
+def insert_chunked(table, rows):
+    """ Inserts rows with one executemany per chunk """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == SEED_CHUNK:
+            db.session.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+
+
+def seed(layout):
+    """ Recreates the tables and fills them as described by the layout """
+    db.drop_all()
+    db.create_all()
+    wishlists = [wishlist_row(n) for n in range(1, layout.scratch_wishlist + 1)]
+    shares = list(share_rows(wishlists))
+    insert_chunked(Wishlist.__table__, wishlists)
+    insert_chunked(Share.__table__, shares)
+    items = (
+        item_row((w - 1) * layout.items + i, w)
+        for w in range(1, layout.wishlists + 1)
+        for i in range(1, layout.items + 1)
+    )
+    insert_chunked(Item.__table__, items)
+    spare_items = (
+        item_row(layout.spare_item(n), layout.scratch_wishlist) for n in range(layout.reserved)
+    )
+    insert_chunked(Item.__table__, spare_items)
+    db.session.commit()
+    if db.engine.dialect.name == "postgresql":
+        reset_sequences()
+    # the inserts above skip the model methods that keep the /stats counts
+    Rollup.rebuild()
+
+
+######################################################################
+#  S C E N A R I O S
+######################################################################
+def item_body(wishlist_id):
+    """ A new item for a wishlist, from the factory """
+    body = ItemFactory().serialize()
+    body["wishlist_id"] = wishlist_id
+    return body
+
+
+def scenarios(layout):
+    """
+    Returns every route to drive as (name, method, request builder)
+
+    A request builder takes the request number and returns (path, JSON body)
+    """
+    def get_item(n):
+        wishlist_id, item_id = layout.random_item()
+        return "/wishlists/{}/items/{}".format(wishlist_id, item_id), None
+
+    def update_item(n):
+        wishlist_id, item_id = layout.random_item()
+        return "/wishlists/{}/items/{}".format(wishlist_id, item_id), item_body(wishlist_id)
+
+    def patch_item(n):
+        wishlist_id, item_id = layout.random_item()
+        return "/wishlists/{}/items/{}".format(wishlist_id, item_id), {"quantity": random.randint(1, 100)}
+
+    def patch_wishlist(n):
+        return "/wishlists/{}".format(layout.random_wishlist()), {"name": WishlistFactory().name}
+
+    def search_wishlist(n):
+        return "/search?q=ceramic&wishlist_id={}".format(layout.random_wishlist()), None
+
+    def update_wishlist(n):
+        body = WishlistFactory().serialize()
+        return "/wishlists/{}".format(layout.random_wishlist()), body
+
+    def create_items_batch(n):
+        wishlist_id = layout.random_wishlist()
+        return "/wishlists/{}/items/batch".format(wishlist_id), [item_body(wishlist_id) for _ in range(10)]
+
+    def create_item(n):
+        wishlist_id = layout.random_wishlist()
+        return "/wishlists/{}/items".format(wishlist_id), item_body(wishlist_id)
+
+    return [
+        ("index", "GET", lambda n: ("/", None)),
+        ("list_wishlists", "GET", lambda n: ("/wishlists?limit=100", None)),
+        ("list_wishlists_by_email", "GET", lambda n: ("/wishlists?email=dog@stern.nyu.edu&limit=100", None)),
+        ("list_wishlists_by_shared_with", "GET", lambda n: ("/wishlists?shared_with=Becca&limit=100", None)),
+        ("get_wishlist", "GET", lambda n: ("/wishlists/{}".format(layout.random_wishlist()), None)),
+        ("list_items", "GET", lambda n: ("/wishlists/{}/items".format(layout.random_wishlist()), None)),
+        ("get_item", "GET", get_item),
+        ("totals_by_wishlist", "GET", lambda n: ("/totals?email=dog@stern.nyu.edu", None)),
+        ("totals_by_email", "GET", lambda n: ("/totals?by=email", None)),
+        ("stats", "GET", lambda n: ("/stats", None)),
+        ("search", "GET", lambda n: ("/search?q=ceramic+mug", None)),
+        ("search_wishlist", "GET", search_wishlist),
+        ("cache_stats", "GET", lambda n: ("/cache/stats", None)),
+        ("pool_stats", "GET", lambda n: ("/pool/stats", None)),
+        ("metrics", "GET", lambda n: ("/metrics", None)),
+        ("create_wishlist", "POST", lambda n: ("/wishlists", WishlistFactory().serialize())),
+        ("update_wishlist", "PUT", update_wishlist),
+        ("patch_wishlist", "PATCH", patch_wishlist),
+        ("share_wishlist", "PUT", lambda n: ("/wishlists/{}/shared".format(layout.random_wishlist()), {})),
+        ("create_item", "POST", create_item),
+        ("create_items_batch", "POST", create_items_batch),
+        ("update_item", "PUT", update_item),
+        ("patch_item", "PATCH", patch_item),
+        ("delete_item", "DELETE", lambda n: (
+            "/wishlists/{}/items/{}".format(layout.scratch_wishlist, layout.spare_item(n)), None)),
+        ("delete_wishlist", "DELETE", lambda n: ("/wishlists/{}".format(layout.spare_wishlist(n)), None)),
+    ]
+
+
+######################################################################
+#  L O A D   D R I V E R
+######################################################################
+_local = threading.local()
+
+
+def session():
+    """ Returns this client thread's keep-alive HTTP session """
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def percentile(sorted_values, fraction):
+    """ Nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(base_url, method, build, count, concurrency):
+    """
+    Sends count requests with concurrency clients and summarizes them
+
+    Every scenario expects a 2xx (or 3xx) answer, so anything else, like a
+    connection failure, counts as an error
+    """
+    def one(n):
+        path, body = build(n)
+        start = time.perf_counter()
+        try:
+            resp = session().request(method, base_url + path, json=body)
+            ok = resp.status_code < 400
+        except requests.RequestException:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(count)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": count,
+        "errors": sum(1 for _, ok in results if not ok),
+        "requests_per_second": round(count / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "max_ms": round(latencies[-1], 3),
+    }
+
+
+######################################################################
+#  S E R V E R
+######################################################################
+def free_port():
+    """ Asks the OS for an unused TCP port """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers, command=None):
+    """
+    Starts the service in a subprocess and waits until it answers
+
+    command(port, workers) may return the argv of another server to start
+    """
+    if command is not None:
+        command = command(port, workers)
+    else:
+        try:
+            import gunicorn  # pylint: disable=unused-import,import-outside-toplevel
+            command = [
+                sys.executable, "-c", "from gunicorn.app.wsgiapp import run; run()",
+                "--workers", str(workers),
+                "--bind", "127.0.0.1:{}".format(port), "--log-level", "warning", "service:app",
+            ]
+        except ImportError:
+            command = [
+                sys.executable, "-c",
+                "from werkzeug.serving import run_simple; from service import app; "
+                "run_simple('127.0.0.1', {}, app, threaded=True)".format(port),
+            ]
+    server = subprocess.Popen(command, cwd=ROOT, env=dict(os.environ))
+    base_url = "http://127.0.0.1:{}".format(port)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited with code {}".format(server.returncode))
+        try:
+            requests.get(base_url + "/", timeout=1)
+            return server, base_url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("The server did not start within 60 seconds")
+
+
+def git_commit():
+    """ Returns the commit being benchmarked, if this is a git checkout """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None, server_command=None):
+    """ Seeds, starts the server, drives every route and reports """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--wishlists", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=50, help="items per wishlist")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--url", help="benchmark an already running server")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data of the last run")
+    parser.add_argument("--only", action="append", help="only drive this route (repeatable)")
+    parser.add_argument("--reset", action="store_true", help="time one DELETE /wishlists/reset at the end")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    app.app_context().push()
+    random.seed(0)
+    layout = Layout(args.wishlists, args.items, args.requests)
+    if not args.no_seed:
+        start = time.perf_counter()
+        seed(layout)
+        print("Seeded {} wishlists x {} items in {:.1f}s".format(
+            args.wishlists, args.items, time.perf_counter() - start))
+    db.session.remove()
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, base_url = start_server(free_port(), args.workers, server_command)
+
+    results = {}
+    try:
+        print("{:<30} {:>9} {:>9} {:>9} {:>10} {:>7}".format(
+            "route", "p50 ms", "p95 ms", "p99 ms", "req/s", "errors"))
+        drive = [
+            (name, method, build, args.requests, args.concurrency)
+            for name, method, build in scenarios(layout)
+            if not args.only or name in args.only
+        ]
+        if args.reset:
+            drive.append(("wishlists_reset", "DELETE", lambda n: ("/wishlists/reset", None), 1, 1))
+        for name, method, build, count, concurrency in drive:
+            result = run_scenario(base_url, method, build, count, concurrency)
+            results[name] = result
+            print("{:<30} {:>9} {:>9} {:>9} {:>10} {:>7}".format(
+                name, result["p50_ms"], result["p95_ms"], result["p99_ms"],
+                result["requests_per_second"], result["errors"]))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "timestamp": datetime.utcnow().isoformat() + "Z",
+                    "database": db.engine.dialect.name,
+                    "wishlists": args.wishlists,
+                    "items_per_wishlist": args.items,
+                    "requests_per_route": args.requests,
+                    "concurrency": args.concurrency,
+                    "server": base_url if args.url else " ".join(server.args),
+                    "results": results,
+                },
+                output,
+                indent=2,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Lookup Index Benchmark
+
+Seeds a database with N wishlists and items, then times the model lookup
+methods and records their query plans twice: once with the secondary
+indexes dropped and once with them in place.
+
+Run it from the project root against a throwaway database, e.g.:
+
+    python -m benchmarks.lookup_indexes --wishlists 20000 --items 10
+    DATABASE_URI=postgres://... python -m benchmarks.lookup_indexes --output plans.json
+
+Without DATABASE_URI a temporary SQLite file is used.
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import argparse
+import statistics
+
+if "DATABASE_URI" not in os.environ:
+    os.environ["DATABASE_URI"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "lookup_indexes.db"
+    )
+
+from service import app  # pylint: disable=wrong-import-position
+from service.models import db, Wishlist, Item  # pylint: disable=wrong-import-position
+
+# Secondary indexes declared on the models (everything but the primary keys)
+INDEXES = [index for model in (Wishlist, Item) for index in model.__table__.indexes]
+
+
+def seed(wishlists, items_per_wishlist):
+    """ Fills the tables with predictable rows using bulk inserts """
+    db.drop_all()
+    db.create_all()
+    rows = [
+        {
+            "id": n,
+            "name": "wishlist-{}".format(n),
+            "email": "user{}@example.com".format(n // 2),
+            "shared": n % 2 == 0,
+        }
+        for n in range(1, wishlists + 1)
+    ]
+    db.session.execute(Wishlist.__table__.insert(), rows)
+    rows = [
+        {
+            "wishlist_id": n,
+            "name": "item-{}".format(i),
+            "sku": "sku-{}".format((n * items_per_wishlist + i) % 50000),
+            "description": "description {}".format(i),
+            "quantity": i,
+        }
+        for n in range(1, wishlists + 1)
+        for i in range(items_per_wishlist)
+    ]
+    db.session.execute(Item.__table__.insert(), rows)
+    db.session.commit()
+
+
+def lookups(wishlists, items_per_wishlist):
+    """ Returns the lookups to measure as (label, query factory) pairs """
+    pick = lambda: random.randint(1, wishlists)
+    return [
+        ("Wishlist.find_by_name", lambda: Wishlist.query.filter(Wishlist.name == "wishlist-{}".format(pick()))),
+        ("Wishlist.find_by_email", lambda: Wishlist.query.filter(Wishlist.email == "user{}@example.com".format(pick() // 2))),
+        ("Item.find_by_sku", lambda: Item.find_by_sku("sku-{}".format(random.randint(0, 49999)))),
+        ("Item.find_by_wishlist", lambda: Item.find_by_wishlist(pick())),
+        ("Item by wishlist and name", lambda: Item.find_by_wishlist(pick()).filter(
+            Item.name == "item-{}".format(random.randrange(items_per_wishlist)))),
+    ]
+
+
+def explain(query):
+    """ Returns the database's query plan for a query as a list of lines """
+    sql = str(query.statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+    if db.engine.dialect.name == "sqlite":
+        return [row[-1] for row in db.session.execute("EXPLAIN QUERY PLAN " + sql)]
+    return [row[0] for row in db.session.execute("EXPLAIN " + sql)]
+
+
+def measure(cases, repeat):
+    """ Times every lookup and captures its plan """
+    results = {}
+    for label, make_query in cases:
+        timings = []
+        for _ in range(repeat):
+            query = make_query()
+            start = time.perf_counter()
+            query.all()
+            timings.append((time.perf_counter() - start) * 1000)
+            db.session.expunge_all()
+        results[label] = {
+            "median_ms": round(statistics.median(timings), 3),
+            "max_ms": round(max(timings), 3),
+            "plan": explain(make_query()),
+        }
+    return results
+
+
+def main(argv=None):
+    """ Seeds the database and prints the before/after comparison """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--wishlists", type=int, default=20000)
+    parser.add_argument("--items", type=int, default=10, help="items per wishlist")
+    parser.add_argument("--repeat", type=int, default=50, help="runs per lookup")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    app.app_context().push()
+    random.seed(0)
+    app.logger.info("Seeding %d wishlists x %d items", args.wishlists, args.items)
+    seed(args.wishlists, args.items)
+    cases = lookups(args.wishlists, args.items)
+
+    for index in INDEXES:
+        index.drop(bind=db.engine)
+    before = measure(cases, args.repeat)
+    for index in INDEXES:
+        index.create(bind=db.engine)
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute("ANALYZE")
+    after = measure(cases, args.repeat)
+
+    print("{:<28} {:>14} {:>14}".format("lookup", "before (ms)", "after (ms)"))
+    for label, _ in cases:
+        print("{:<28} {:>14} {:>14}".format(label, before[label]["median_ms"], after[label]["median_ms"]))
+        print("    before: {}".format(" / ".join(before[label]["plan"])))
+        print("    after:  {}".format(" / ".join(after[label]["plan"])))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {
+                    "database": db.engine.dialect.name,
+                    "wishlists": args.wishlists,
+                    "items_per_wishlist": args.items,
+                    "before": before,
+                    "after": after,
+                },
+                output,
+                indent=2,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,5 +15,55 @@ if 'VCAP_SERVICES' in os.environ:
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Size the connection pool of each gunicorn worker so that all the workers
+# together stay under the connection limit of the database plan.
+# gunicorn itself reads WEB_CONCURRENCY as its default number of workers.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+DB_CONNECTIONS_PER_WORKER = max(1, DB_MAX_CONNECTIONS // WEB_CONCURRENCY)
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(DB_CONNECTIONS_PER_WORKER // 4)))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(max(1, DB_CONNECTIONS_PER_WORKER - DB_MAX_OVERFLOW))))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+
+# SQLite does not use a QueuePool, so it takes none of the pool options
+SQLALCHEMY_ENGINE_OPTIONS = {}
+if not DATABASE_URI.startswith("sqlite"):
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+# Largest page size a client may request with ?limit= on list endpoints
+PAGE_LIMIT_MAX = int(os.getenv("PAGE_LIMIT_MAX", "1000"))
+
+# Number of matches on a /search page when the client sends no ?limit=
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+
+# Largest number of items accepted by one batch create request
+BATCH_ITEMS_MAX = int(os.getenv("BATCH_ITEMS_MAX", "1000"))
+
+# Read-through cache of single wishlist and item lookups: lru, redis or none
+CACHE_TYPE = os.getenv("CACHE_TYPE", "lru")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Per-request timing breakdown in a Server-Timing header, optionally logged
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("true", "1", "yes")
+SERVER_TIMING_LOG = os.getenv("SERVER_TIMING_LOG", "false").lower() in ("true", "1", "yes")
+
+# Negotiated gzip/brotli compression of responses of at least COMPRESS_MIN_SIZE bytes
+COMPRESS = os.getenv("COMPRESS", "true").lower() in ("true", "1", "yes")
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+
+# Serve the static files from memory under content hashed, immutable URLs
+ASSETS_FINGERPRINT = os.getenv("ASSETS_FINGERPRINT", "true").lower() in ("true", "1", "yes")
+ASSETS_INDEX_MAX_AGE = int(os.getenv("ASSETS_INDEX_MAX_AGE", "60"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""
+Cooperative Entry Point
+
+Serves the same Flask app as service:app, but on gevent: every request
+runs in a greenlet and yields to the others whenever it waits on a socket,
+so one worker process keeps hundreds of requests in flight while they wait
+on the database. psycogreen makes psycopg2 wait through gevent too.
+
+Run it under gunicorn's gevent worker:
+
+    gunicorn -c gunicorn.conf.py -k gevent --worker-connections 1000 cooperative:app
+
+or on its own with the gevent WSGI server:
+
+    PORT=8080 python cooperative.py
+
+The monkey patching must happen before anything else is imported, which
+is why this module lives outside the service package.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+try:
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+except ImportError:  # psycopg2 is only needed for PostgreSQL
+    pass
+
+import os  # pylint: disable=wrong-import-position
+from service import app  # pylint: disable=wrong-import-position,unused-import
+
+if __name__ == "__main__":
+    from gevent.pywsgi import WSGIServer
+    WSGIServer(("0.0.0.0", int(os.getenv("PORT", "8080"))), app).serve_forever()
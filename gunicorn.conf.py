@@ -0,0 +1,41 @@
+"""
+gunicorn settings
+
+Load it with: gunicorn -c gunicorn.conf.py service:app
+
+Keeps the Prometheus multiprocess directory (prometheus_multiproc_dir)
+consistent: it is emptied when the master starts, so counters of an
+earlier run are not added again, and the live gauges of every worker that
+exits are dropped. See service/metrics.py.
+
+With --preload the master imports the app once and the workers share it.
+Importing it does not connect to the database, but anything the master
+did open is closed before each fork, so no worker inherits a connection.
+"""
+import os
+import sys
+import glob
+
+
+def on_starting(server):
+    """ Removes the metric files left behind by an earlier run """
+    path = os.environ.get("prometheus_multiproc_dir")
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for name in glob.glob(os.path.join(path, "*.db")):
+            os.remove(name)
+
+
+def child_exit(server, worker):
+    """ Drops the live gauges of a worker that exited """
+    if os.environ.get("prometheus_multiproc_dir"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def pre_fork(server, worker):
+    """ Closes the master's database connections before a worker is forked """
+    service = sys.modules.get("service")
+    if service is not None:  # the app was preloaded
+        with service.app.app_context():
+            service.db.engine.dispose()
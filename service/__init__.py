@@ -1,23 +1,44 @@
 """
 Package: service
 Package for the application models and service routes
-This module creates and configures the Flask app and sets up the logging
-and SQL database
+create_app() creates and configures the Flask app and sets up the logging.
+Creating the app does not touch the database: the engine connects on the
+first query, and the tables are created by the "flask db-create" command,
+so importing the package is fast and works while the database is down.
 """
-import os
-import sys
 import logging
 from flask import Flask
+from service.models import db
+from service.cache import cache
+from service import service, commands, pool, timing, metrics, compression, assets
 
-# Create Flask application
-app = Flask(__name__)
-app.config.from_object('config')
 
-# Import the rutes After the Flask app is created
-from service import service, models
+def create_app(config="config"):
+    """ Creates and configures an instance of the service """
+    app = Flask(__name__)
+    app.config.from_object(config)
 
-# Set up logging for production
-if __name__ != '__main__':
+    pool.init_app(app)  # must pick the pool class before the engine is created
+    db.init_app(app)
+    app.register_blueprint(service.api)
+    commands.init_app(app)
+    cache.init_app(app)
+    timing.init_app(app)
+    metrics.init_app(app)
+    # registered last so it runs first, before the other after_request hooks
+    compression.init_app(app)
+    assets.init_app(app)
+    init_logging(app)
+
+    app.logger.info(70 * "*")
+    app.logger.info("  TEST   S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
+    app.logger.info("Service inititalized!")
+    return app
+
+
+def init_logging(app):
+    """ Set up logging for production """
     gunicorn_logger = logging.getLogger('gunicorn.error')
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
@@ -28,15 +49,6 @@ if __name__ != '__main__':
         handler.setFormatter(formatter)
     app.logger.info('Logging handler established')
 
-app.logger.info(70 * "*")
-app.logger.info("  TEST   S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
-
-try:
-    service.init_db()  # make our sqlalchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
 
-app.logger.info("Service inititalized!")
+# The instance gunicorn serves as service:app
+app = create_app()
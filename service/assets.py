@@ -0,0 +1,150 @@
+"""
+Fingerprinted Static Assets
+
+At startup every file under the static folder is read into an in-memory
+asset table under a URL with its content hash in the name, e.g.
+
+    static/css/blue_bootstrap.min.css -> /static/css/blue_bootstrap.min.1b2c3d4e5f60.css
+
+Those URLs never change content, so they are sent with an immutable
+Cache-Control and browsers stop revalidating them. index.html is rewritten
+to reference the fingerprinted URLs and is itself only cached for
+ASSETS_INDEX_MAX_AGE seconds, so a deploy is picked up quickly.
+
+The table is served by a small WSGI layer in front of Flask: those
+requests never reach Flask's routing or the file system. The gzip and
+brotli variants are compressed once when the table is built, reusing the
+files written by "flask precompress-static" when they are there. Plain
+/static/ URLs still work through Flask's static route.
+"""
+import os
+import re
+import hashlib
+import mimetypes
+from werkzeug.wrappers import Request, Response
+from service import compression
+
+# Cache-Control of fingerprinted assets, which never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# References to static files in index.html, e.g. src="static/js/rest_api.js"
+STATIC_REFERENCE = re.compile(r'((?:src|href)\s*=\s*")static/([^"]+)(")')
+
+
+class Asset():
+    """ One static file held in memory, with its compressed variants """
+
+    __slots__ = ("data", "mimetype", "etag", "cache_control", "variants")
+
+    def __init__(self, data, mimetype, cache_control, variants):
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(data).hexdigest()[:16]
+        self.cache_control = cache_control
+        self.variants = variants
+
+
+def fingerprint(path, data):
+    """ Inserts the content hash of a file into its name """
+    root, ext = os.path.splitext(path)
+    return "{}.{}{}".format(root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def _variants(path, data, mimetype, levels):
+    """ Returns the compressed variants of a file, read from disk or built """
+    variants = {}
+    if mimetype not in compression.COMPRESSIBLE:
+        return variants
+    for encoding in compression.SUFFIXES:
+        precompressed = path + compression.SUFFIXES[encoding] if path else None
+        if precompressed and os.path.isfile(precompressed):
+            with open(precompressed, "rb") as source:
+                variants[encoding] = source.read()
+        elif encoding in compression.encodings():
+            variants[encoding] = compression.compress(data, encoding, levels[encoding])
+    return variants
+
+
+class AssetTable():
+    """ Maps request paths to in-memory assets """
+
+    def __init__(self, folder, index_max_age=60, levels=None):
+        self.assets = {}
+        self.urls = {}
+        levels = levels or compression.levels_from({})
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if name.endswith(tuple(compression.SUFFIXES.values())) or name == "index.html":
+                    continue
+                path = os.path.join(root, name)
+                with open(path, "rb") as source:
+                    data = source.read()
+                relative = os.path.relpath(path, folder).replace(os.sep, "/")
+                url = "static/" + fingerprint(relative, data)
+                mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                self.urls[relative] = url
+                self.assets["/" + url] = Asset(data, mimetype, IMMUTABLE, _variants(path, data, mimetype, levels))
+        index = os.path.join(folder, "index.html")
+        if os.path.isfile(index):
+            with open(index, "rb") as source:
+                data = self.rewrite(source.read().decode("utf-8")).encode("utf-8")
+            cache_control = "public, max-age={}".format(index_max_age)
+            self.assets["/"] = Asset(data, "text/html", cache_control, _variants(None, data, "text/html", levels))
+
+    def url(self, filename):
+        """ Returns the fingerprinted URL of a static file """
+        return self.urls[filename]
+
+    def rewrite(self, html):
+        """ Points the static references of a page at their fingerprinted URLs """
+        def replace(match):
+            url = self.urls.get(match.group(2))
+            return match.group(1) + url + match.group(3) if url else match.group(0)
+        return STATIC_REFERENCE.sub(replace, html)
+
+
+class AssetMiddleware():
+    """ Answers requests for the asset table before they reach Flask """
+
+    def __init__(self, wsgi_app, table):
+        self.wsgi_app = wsgi_app
+        self.table = table
+
+    def __call__(self, environ, start_response):
+        asset = self.table.assets.get(environ.get("PATH_INFO"))
+        if asset is None or environ["REQUEST_METHOD"] not in ("GET", "HEAD"):
+            return self.wsgi_app(environ, start_response)
+        return self.respond(Request(environ), asset)(environ, start_response)
+
+    @staticmethod
+    def respond(request, asset):
+        """ Builds the response for an asset, compressed or 304 if possible """
+        response = Response(mimetype=asset.mimetype)
+        response.headers["Cache-Control"] = asset.cache_control
+        if asset.variants:
+            response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(list(asset.variants)) if asset.variants else None
+        response.set_etag(asset.etag + ("-" + encoding if encoding else ""))
+        if request.if_none_match.contains_weak(response.get_etag()[0]):
+            response.status_code = 304
+            return response
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+            response.set_data(asset.variants[encoding])
+        else:
+            response.set_data(asset.data)
+        return response
+
+
+def init_app(app):
+    """ Builds the asset table and serves it in front of the app """
+    if not app.config.get("ASSETS_FINGERPRINT", True):
+        return None
+    table = AssetTable(
+        app.static_folder,
+        app.config.get("ASSETS_INDEX_MAX_AGE", 60),
+        compression.levels_from(app.config),
+    )
+    app.wsgi_app = AssetMiddleware(app.wsgi_app, table)
+    app.extensions["assets"] = table
+    return table
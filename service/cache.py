@@ -0,0 +1,214 @@
+"""
+Read-through Cache
+
+Caches the serialized payloads of single wishlist and item lookups so hot
+lists are answered without touching the database. The backend is chosen
+by the CACHE_TYPE setting:
+
+    lru    an in-process LRU with a TTL (the default)
+    redis  a Redis compatible server at CACHE_REDIS_URL, shared by workers
+    none   no caching at all
+
+The views must call delete() or clear() after every write that changes a
+cached payload.
+"""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # redis is only needed for CACHE_TYPE=redis
+    redis = None
+
+logger = logging.getLogger("flask.app")
+
+
+class CacheError(Exception):
+    """ Used when the cache is misconfigured """
+    pass
+
+
+class NullBackend():
+    """ A backend that never stores anything """
+
+    name = "none"
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class LRUBackend():
+    """ An in-process, thread safe LRU cache whose entries expire after a TTL """
+
+    name = "lru"
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend():
+    """ A Redis compatible server shared by every worker """
+
+    name = "redis"
+
+    # Every key is prefixed so clear() only removes our own entries
+    PREFIX = "wishlists:"
+
+    def __init__(self, url, ttl):
+        if redis is None:
+            raise CacheError("CACHE_TYPE=redis needs the redis package installed")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(self.PREFIX + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.PREFIX + key, json.dumps(value), ex=self.ttl)
+
+    def delete(self, keys):
+        if keys:
+            self.client.delete(*[self.PREFIX + key for key in keys])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.PREFIX + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(self.PREFIX + "*"))
+
+
+class Cache():
+    """
+    Read-through cache of serialized payloads
+
+    Like the SQLAlchemy object it is created empty and bound to the Flask
+    app later with init_app(). Hits and misses are counted per process.
+    """
+
+    def __init__(self):
+        self.backend = NullBackend()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """ Picks the backend from the app configuration """
+        cache_type = app.config.get("CACHE_TYPE", "lru")
+        ttl = app.config.get("CACHE_TTL", 60)
+        if cache_type == "lru":
+            self.backend = LRUBackend(app.config.get("CACHE_MAX_ENTRIES", 1024), ttl)
+        elif cache_type == "redis":
+            self.backend = RedisBackend(app.config["CACHE_REDIS_URL"], ttl)
+        elif cache_type == "none":
+            self.backend = NullBackend()
+        else:
+            raise CacheError("Unknown CACHE_TYPE: {}".format(cache_type))
+        self.hits = 0
+        self.misses = 0
+        logger.info("Using the %s cache", self.backend.name)
+
+    def get(self, key):
+        """ Returns the cached value for a key or None, counting the hit or miss """
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """ Stores a value under a key """
+        self.backend.set(key, value)
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for a key, calling loader() on a miss
+
+        Exceptions raised by the loader, e.g. NotFound, are not cached
+        """
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def delete(self, *keys):
+        """ Invalidates the given keys """
+        self.backend.delete(keys)
+
+    def clear(self):
+        """ Invalidates everything """
+        self.backend.clear()
+
+    def stats(self):
+        """ Returns the hit and miss counters of this process """
+        return {
+            "backend": self.backend.name,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def wishlist_key(wishlist_id):
+    """ Cache key of a serialized Wishlist (including its items) """
+    return "wishlist:{}".format(wishlist_id)
+
+
+def item_key(item_id):
+    """ Cache key of a serialized Item """
+    return "item:{}".format(item_id)
+
+
+cache = Cache()
@@ -0,0 +1,256 @@
+"""
+Bulk Import and Export Commands
+
+Flask CLI commands that copy every wishlist, item and share to or from a file
+without going through the REST API, e.g.:
+
+    flask export-data --format csv --output backup.csv
+    flask import-data --format csv backup.csv
+
+Both formats hold one record per line (or row) with a "type" field of
+"wishlist", "item" or "share". All wishlists are written before the items
+and shares so a file can be imported front to back. Ids are kept so items
+and shares still point at their wishlists after a restore.
+
+The build step runs one more command, which writes the compressed variants
+of the static files (see service/compression.py):
+
+    flask precompress-static
+
+The tables are created explicitly, once per deploy, never on import, and
+databases made by older versions are upgraded in place (see
+service/migrations.py):
+
+    flask db-create
+    flask db-migrate
+
+The counts behind /stats are kept up to date by every write. An import
+recomputes them, and so can be done by hand after changing rows in SQL:
+
+    flask rebuild-stats
+"""
+import io
+import re
+import csv
+import json
+import time
+from itertools import islice
+import click
+from sqlalchemy import Boolean, Integer
+from flask import current_app
+from flask.cli import with_appcontext
+from service.models import db, Wishlist, Item, Share, Rollup
+from service.cache import cache
+from service import compression, migrations
+
+# Number of records read or written per query / insert
+CHUNK_SIZE = 5000
+
+# Models in the order they are exported and imported, keyed by record type
+MODELS = (("wishlist", Wishlist), ("item", Item), ("share", Share))
+
+
+def columns(model):
+    """ Returns the column names of a model's table """
+    return [column.name for column in model.__table__.columns]
+
+
+def csv_fields():
+    """ Returns the CSV header: the record type and every column of every model """
+    fields = ["type"]
+    for _, model in MODELS:
+        fields.extend(name for name in columns(model) if name not in fields)
+    return fields
+
+
+######################################################################
+#  E X P O R T
+######################################################################
+@click.command("export-data")
+@click.option("--format", "fmt", type=click.Choice(["ndjson", "csv"]), default="ndjson")
+@click.option("--output", type=click.File("w"), default="-", help="File to write, - for stdout")
+@click.option("--chunk-size", type=int, default=CHUNK_SIZE, show_default=True)
+@with_appcontext
+def export_data(fmt, output, chunk_size):
+    """ Exports all wishlists, items and shares """
+    start = time.monotonic()
+    if fmt == "csv":
+        writer = csv.DictWriter(output, fieldnames=csv_fields())
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda record: output.write(json.dumps(record) + "\n")
+
+    counts = {}
+    for record_type, model in MODELS:
+        counts[record_type] = 0
+        for rows in iter_rows(model, chunk_size):
+            for row in rows:
+                record = row._asdict()
+                record["type"] = record_type
+                write(record)
+            counts[record_type] += len(rows)
+    output.flush()
+    report("Exported", counts, time.monotonic() - start)
+
+
+def iter_rows(model, chunk_size):
+    """ Yields chunks of plain row tuples of a model's table in id order """
+    query = db.session.query(*model.__table__.columns)
+    return model.iter_pages(query, size=chunk_size)
+
+
+######################################################################
+#  I M P O R T
+######################################################################
+@click.command("import-data")
+@click.argument("source", type=click.File("r"))
+@click.option("--format", "fmt", type=click.Choice(["ndjson", "csv"]), default="ndjson")
+@click.option("--chunk-size", type=int, default=CHUNK_SIZE, show_default=True)
+@with_appcontext
+def import_data(source, fmt, chunk_size):
+    """ Imports wishlists, items and shares from an export file """
+    start = time.monotonic()
+    if fmt == "csv":
+        records = csv.DictReader(source)
+    else:
+        records = (json.loads(line) for line in source if line.strip())
+
+    counts = {record_type: 0 for record_type, _ in MODELS}
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        for record_type, model in MODELS:
+            rows = [to_row(model, record) for record in chunk if record["type"] == record_type]
+            if rows:
+                insert_rows(model, rows)
+                counts[record_type] += len(rows)
+        db.session.commit()
+
+    if db.engine.dialect.name == "postgresql":
+        reset_sequences()
+    # the bulk inserts skip the model methods that keep the counts
+    Rollup.rebuild()
+    cache.clear()
+    report("Imported", counts, time.monotonic() - start)
+
+
+def to_row(model, record):
+    """ Converts an imported record into column values for a model's table """
+    row = {}
+    for column in model.__table__.columns:
+        value = record.get(column.name)
+        if value == "" or value is None:
+            # e.g. a column added after the file was exported
+            value = column.default.arg if column.default is not None else None
+        elif isinstance(column.type, Boolean) and isinstance(value, str):
+            value = value.lower() in ("true", "t", "1", "yes")
+        elif isinstance(column.type, Integer) and isinstance(value, str):
+            value = to_integer(value) if column.nullable else int(value)
+        row[column.name] = value
+    return row
+
+
+def to_integer(value):
+    """
+    Reads an optional integer column the way quantity_to_integer does
+
+    Files exported before that migration hold free text quantities: up to
+    9 digits, with spaces around them, keep their value and anything else
+    (e.g. "XX") becomes None rather than stopping the import
+    """
+    value = value.strip(" ")
+    return int(value) if re.fullmatch("[0-9]{1,9}", value) else None
+
+
+def insert_rows(model, rows):
+    """
+    Inserts a chunk of rows into a model's table
+
+    Uses COPY FROM STDIN on Postgres and a single executemany elsewhere
+    """
+    table = model.__table__
+    if db.engine.dialect.name != "postgresql":
+        db.session.execute(table.insert(), rows)
+        return
+    names = columns(model)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if row[name] is None else row[name] for name in names])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(table.name, ", ".join(names)),
+        buffer,
+    )
+
+
+@click.command("precompress-static")
+@with_appcontext
+def precompress_static():
+    """ Writes .gz (and .br) variants of the static JS, CSS and HTML files """
+    written = compression.precompress_static(
+        current_app.static_folder, compression.levels_from(current_app.config)
+    )
+    click.echo("Wrote {} precompressed files".format(len(written)), err=True)
+
+
+@click.command("db-create")
+@with_appcontext
+def db_create():
+    """ Creates the tables that do not exist yet """
+    db.create_all()
+    click.echo("Created the tables in {}".format(repr(db.engine.url)), err=True)
+
+
+@click.command("db-migrate")
+@with_appcontext
+def db_migrate():
+    """ Upgrades the tables made by older versions of the service """
+    for name in migrations.upgrade():
+        click.echo("Applied {}".format(name), err=True)
+
+
+@click.command("rebuild-stats")
+@with_appcontext
+def rebuild_stats():
+    """ Recomputes the counts behind /stats from the wishlist and item tables """
+    Rollup.rebuild()
+    click.echo("Rebuilt the statistics of {} wishlists".format(Rollup.total("wishlists")), err=True)
+
+
+def init_app(app):
+    """ Registers the commands with the app's CLI """
+    for command in (export_data, import_data, precompress_static, db_create, db_migrate, rebuild_stats):
+        app.cli.add_command(command)
+
+
+def reset_sequences():
+    """ Moves the Postgres id sequences past the imported ids """
+    for _, model in MODELS:
+        table = model.__table__.name
+        db.session.execute(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+            "COALESCE((SELECT MAX(id) FROM {0}), 0) + 1, false)".format(table)
+        )
+    db.session.commit()
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def report(action, counts, elapsed):
+    """ Prints the number of records copied and the throughput to stderr """
+    total = sum(counts.values())
+    rate = total / elapsed if elapsed > 0 else float("inf")
+    click.echo(
+        "{} {} in {:.2f}s ({:.0f} records/s)".format(
+            action,
+            ", ".join("{} {}s".format(count, name) for name, count in counts.items()),
+            elapsed,
+            rate,
+        ),
+        err=True,
+    )
@@ -0,0 +1,135 @@
+"""
+Response Compression
+
+Compresses responses with gzip, or brotli when the brotli package is
+installed and the client prefers it, once their body reaches
+COMPRESS_MIN_SIZE bytes. Smaller bodies are not worth the CPU time.
+
+Static files are not compressed per request. Instead, the precompress-static
+command writes .gz and .br variants of the JS, CSS and HTML files next to
+them at build time, and those are sent as they are to clients that accept
+them.
+
+A compressed body is a different representation than the plain one, so
+its ETag is made weak, as nginx does. The views compare If-None-Match
+weakly, so conditional requests still get their 304s.
+"""
+import os
+import gzip
+import mimetypes
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Media types worth compressing
+COMPRESSIBLE = frozenset([
+    "application/json",
+    "application/javascript",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+])
+
+# Static files precompressed by precompress_static(), and their suffixes
+PRECOMPRESSED_EXTENSIONS = (".css", ".js", ".html")
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def encodings():
+    """ Returns the supported encodings, best first """
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(data, encoding, level):
+    """ Compresses bytes with the given content coding """
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    # mtime=0 keeps the output reproducible
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def negotiate(available=None):
+    """ Returns the encoding the client accepts best, or None """
+    return request.accept_encodings.best_match(available or encodings())
+
+
+######################################################################
+#  H O O K S
+######################################################################
+def _compress_response(response, min_size, levels):
+    if response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add("Accept-Encoding")
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding, levels[encoding]))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def send_static(filename):
+    """ Serves a static file, precompressed if a variant exists and is accepted """
+    if not filename.endswith(PRECOMPRESSED_EXTENSIONS):
+        return current_app.send_static_file(filename)
+    folder = current_app.static_folder
+    available = [
+        encoding for encoding in SUFFIXES
+        if os.path.isfile(os.path.join(folder, filename + SUFFIXES[encoding]))
+    ]
+    encoding = negotiate(available) if available else None
+    if encoding is None:
+        response = current_app.send_static_file(filename)
+    else:
+        response = send_from_directory(
+            folder, filename + SUFFIXES[encoding], mimetype=mimetypes.guess_type(filename)[0]
+        )
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def precompress_static(folder, levels):
+    """ Writes .gz (and .br) variants of every text asset under folder """
+    written = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if not name.endswith(PRECOMPRESSED_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as source:
+                data = source.read()
+            for encoding in encodings():
+                with open(path + SUFFIXES[encoding], "wb") as target:
+                    target.write(compress(data, encoding, levels[encoding]))
+                written.append(path + SUFFIXES[encoding])
+    return written
+
+
+def levels_from(config):
+    """ Returns the compression level of each encoding """
+    return {"gzip": config.get("COMPRESS_GZIP_LEVEL", 6), "br": config.get("COMPRESS_BROTLI_QUALITY", 5)}
+
+
+def init_app(app):
+    """ Compresses large responses and serves precompressed static files """
+    if not app.config.get("COMPRESS", True):
+        return
+    min_size = app.config.get("COMPRESS_MIN_SIZE", 1024)
+    levels = levels_from(app.config)
+    app.after_request(lambda response: _compress_response(response, min_size, levels))
+    app.view_functions["static"] = send_static
@@ -0,0 +1,142 @@
+"""
+Prometheus Metrics
+
+Counts requests and errors, and records latency histograms labeled by
+route and method, plus database query counts and connection pool gauges.
+They are served in the Prometheus text format at /metrics.
+
+Under gunicorn every worker is its own process, so the values must be
+shared: set the prometheus_multiproc_dir environment variable to an empty
+directory before the service starts and every worker writes its values
+to memory mapped files there. /metrics then adds them up across workers,
+whichever worker answers the scrape. gunicorn.conf.py clears the
+directory on start and removes the files of dead workers.
+"""
+import os
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+
+MULTIPROC_DIR_ENV = "prometheus_multiproc_dir"
+
+REQUESTS = Counter(
+    "wishlists_http_requests_total",
+    "HTTP requests handled",
+    ["method", "route", "status"],
+)
+ERRORS = Counter(
+    "wishlists_http_request_errors_total",
+    "HTTP requests that ended in a server error",
+    ["method", "route"],
+)
+LATENCY = Histogram(
+    "wishlists_http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["method", "route"],
+)
+QUERIES = Counter(
+    "wishlists_db_queries_total",
+    "SQL statements executed",
+    ["route"],
+)
+POOL_SIZE = Gauge(
+    "wishlists_db_pool_size",
+    "Connections the pools may keep open",
+    multiprocess_mode="livesum",
+)
+POOL_CONNECTIONS = Gauge(
+    "wishlists_db_pool_connections",
+    "Database connections currently open",
+    multiprocess_mode="livesum",
+)
+POOL_CHECKED_OUT = Gauge(
+    "wishlists_db_pool_checked_out",
+    "Database connections currently checked out of the pools",
+    multiprocess_mode="livesum",
+)
+
+
+def route_label():
+    """ Returns the URL rule of the current request, not the raw path """
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+######################################################################
+#  H O O K S
+######################################################################
+def _start_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _finish_request(response):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return response
+    method, route = request.method, route_label()
+    LATENCY.labels(method, route).observe(time.perf_counter() - start)
+    REQUESTS.labels(method, route, str(response.status_code)).inc()
+    if response.status_code >= 500:
+        ERRORS.labels(method, route).inc()
+    return response
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    QUERIES.labels(route_label() if has_request_context() else "none").inc()
+
+
+def _connection_opened(dbapi_connection, connection_record):
+    POOL_CONNECTIONS.inc()
+
+
+def _connection_closed(dbapi_connection, connection_record):
+    POOL_CONNECTIONS.dec()
+
+
+def _checked_out(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKED_OUT.inc()
+
+
+def _checked_in(dbapi_connection, connection_record):
+    POOL_CHECKED_OUT.dec()
+
+
+LISTENERS = (
+    (Engine, "after_cursor_execute", _count_query),
+    (Pool, "connect", _connection_opened),
+    (Pool, "close", _connection_closed),
+    (Pool, "checkout", _checked_out),
+    (Pool, "checkin", _checked_in),
+)
+
+
+def init_app(app):
+    """ Records the metrics of every request and database connection """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    for target, name, listener in LISTENERS:
+        if not event.contains(target, name, listener):
+            event.listen(target, name, listener)
+    options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    POOL_SIZE.set(options.get("pool_size", 0) + options.get("max_overflow", 0))
+
+
+def registry():
+    """ Returns the registry to collect from, merging every worker if needed """
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        merged = CollectorRegistry()
+        multiprocess.MultiProcessCollector(merged)
+        return merged
+    return REGISTRY
+
+
+def latest():
+    """ Returns the current metrics in the Prometheus text format """
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
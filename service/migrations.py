@@ -0,0 +1,287 @@
+"""
+Schema Migrations
+
+Upgrades, in place, a database whose tables were made by an older version
+of the service:
+
+    flask db-migrate
+
+Every step checks the schema before it changes anything, so the command is
+safe to run on each deploy, on a new database or an up to date one alike.
+The steps of one run share a transaction, which Postgres rolls back as a
+whole if any of them fails.
+"""
+import logging
+import sqlite3
+from sqlalchemy import Integer, inspect, text
+from sqlalchemy.schema import CreateIndex
+from service.models import db, Wishlist, Item, Share, Rollup, create_search_index
+
+logger = logging.getLogger("flask.app")
+
+# The fixed recipient columns of the wishlist table, and their share positions
+LEGACY_SHARE_COLUMNS = (("shared_with1", 1), ("shared_with2", 2), ("shared_with3", 3))
+
+
+def columns(table):
+    """ Returns the column names of a table as it is in the database """
+    return {column["name"] for column in inspect(db.session.connection()).get_columns(table)}
+
+
+def column_type(table, name):
+    """ Returns the type of a column as it is in the database, or None if it does not exist """
+    connection = db.session.connection()
+    if not db.engine.dialect.has_table(connection, table):
+        return None
+    for column in inspect(connection).get_columns(table):
+        if column["name"] == name:
+            return column["type"]
+    return None
+
+
+def can_drop_columns():
+    """ Returns True if the database supports ALTER TABLE ... DROP COLUMN """
+    if db.engine.dialect.name == "sqlite":
+        return sqlite3.sqlite_version_info >= (3, 35, 0)
+    return True
+
+
+######################################################################
+#  M I G R A T I O N S
+######################################################################
+def add_wishlist_version():
+    """
+    Adds the version column of wishlist, which ETags are built from
+
+    Every existing Wishlist starts at version 1.
+    """
+    connection = db.session.connection()
+    if not db.engine.dialect.has_table(connection, "wishlist") or "version" in columns("wishlist"):
+        return False
+    connection.execute(text("ALTER TABLE wishlist ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+    return True
+
+
+def move_shares_to_table():
+    """
+    Moves the shared_with1..3 columns of wishlist into the share table
+
+    Returns True if there were columns to move. Older SQLite versions
+    cannot drop columns, so there the moved columns stay behind, unused.
+    """
+    connection = db.session.connection()
+    Share.__table__.create(connection, checkfirst=True)
+    legacy = [(name, position) for name, position in LEGACY_SHARE_COLUMNS if name in columns("wishlist")]
+    for name, position in legacy:
+        # skips the rows an earlier run copied already
+        connection.execute(
+            text(
+                "INSERT INTO share (wishlist_id, position, email) "
+                "SELECT id, :position, {0} FROM wishlist "
+                "WHERE {0} IS NOT NULL AND {0} <> '' AND NOT EXISTS ("
+                "SELECT 1 FROM share WHERE share.wishlist_id = wishlist.id "
+                "AND share.position = :position)".format(name)
+            ),
+            position=position,
+        )
+    if legacy and can_drop_columns():
+        for name, _ in legacy:
+            connection.execute(text("ALTER TABLE wishlist DROP COLUMN {}".format(name)))
+    return bool(legacy)
+
+
+def cascade_wishlist_deletes():
+    """
+    Makes the foreign keys of item and share to wishlist ON DELETE CASCADE
+
+    SQLite can only change a constraint by rebuilding its table, and does
+    not enforce foreign keys by default, so its tables are left alone.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return False
+    connection = db.session.connection()
+    changed = False
+    for table in ("item", "share"):
+        for key in inspect(connection).get_foreign_keys(table):
+            if key["referred_table"] != "wishlist" or key["options"].get("ondelete", "").upper() == "CASCADE":
+                continue
+            connection.execute(text(
+                'ALTER TABLE {0} DROP CONSTRAINT "{1}", ADD CONSTRAINT "{1}" '
+                "FOREIGN KEY ({2}) REFERENCES wishlist (id) ON DELETE CASCADE".format(
+                    table, key["name"], ", ".join(key["constrained_columns"])
+                )
+            ))
+            changed = True
+    return changed
+
+
+def quantity_to_integer():
+    """
+    Converts the quantity of item from a string column to an integer one
+
+    Up to 9 digits, with spaces around them, keep their value; anything
+    else (e.g. "XX") can not be totaled and becomes NULL. SQLite can not
+    change the type of a column, so there the table is rebuilt and the
+    rows are copied over.
+    """
+    current = column_type("item", "quantity")
+    if current is None or isinstance(current, Integer):
+        return False
+    connection = db.session.connection()
+    if db.engine.dialect.name == "postgresql":
+        connection.execute(text(
+            "ALTER TABLE item ALTER COLUMN quantity TYPE INTEGER USING "
+            "CASE WHEN btrim(quantity) ~ '^[0-9]{1,9}$' THEN btrim(quantity)::integer END"
+        ))
+        return True
+    quantity = (
+        "CASE WHEN trim(quantity) <> '' AND trim(quantity) NOT GLOB '*[^0-9]*' "
+        "AND length(trim(quantity)) <= 9 THEN CAST(trim(quantity) AS INTEGER) END"
+    )
+    names = [column.name for column in Item.__table__.columns]
+    # the index names must be free for the new table
+    for index in inspect(connection).get_indexes("item"):
+        connection.execute(text("DROP INDEX {}".format(index["name"])))
+    connection.execute(text("ALTER TABLE item RENAME TO item_old"))
+    Item.__table__.create(connection)
+    connection.execute(text("INSERT INTO item ({}) SELECT {} FROM item_old".format(
+        ", ".join(names), ", ".join(quantity if name == "quantity" else name for name in names)
+    )))
+    connection.execute(text("DROP TABLE item_old"))
+    return True
+
+
+def create_rollups():
+    """
+    Creates the rollup table behind /stats and counts the existing rows
+
+    A new database gets the table from db-create, already empty and
+    consistent, so only databases with data and without the table change.
+    """
+    connection = db.session.connection()
+    has_table = db.engine.dialect.has_table
+    if not (has_table(connection, "wishlist") and has_table(connection, "item")) or has_table(connection, "rollup"):
+        return False
+    Rollup.__table__.create(connection)
+    Rollup.recount()
+    return True
+
+
+def index_item_search():
+    """
+    Creates the full-text index behind /search on an existing item table
+
+    On Postgres the GIN index reads the rows as it is built. On SQLite the
+    new FTS5 table is filled from the item table with its rebuild command.
+    """
+    connection = db.session.connection()
+    if not db.engine.dialect.has_table(connection, "item"):
+        return False
+    if db.engine.dialect.name == "postgresql":
+        if connection.execute(text("SELECT to_regclass('ix_item_search')")).scalar() is not None:
+            return False
+        create_search_index(connection)
+        return True
+    if db.engine.dialect.has_table(connection, "item_search"):
+        return False
+    create_search_index(connection)
+    connection.execute(text("INSERT INTO item_search (item_search) VALUES ('rebuild')"))
+    return True
+
+
+def create_lookup_indexes():
+    """
+    Creates the indexes of the wishlist and item lookup columns
+
+    db-create only adds them to new tables. IF NOT EXISTS keeps two
+    deploys migrating at once from failing on each other's indexes.
+    """
+    connection = db.session.connection()
+    created = False
+    for model in (Wishlist, Item):
+        table = model.__table__
+        if not db.engine.dialect.has_table(connection, table.name):
+            continue
+        existing = {index["name"] for index in inspect(connection).get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            statement = str(CreateIndex(index).compile(dialect=db.engine.dialect))
+            connection.execute(text(statement.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1)))
+            created = True
+    return created
+
+
+def pattern_index_item_names():
+    """
+    Rebuilds the (wishlist_id, name) index of item with text_pattern_ops
+
+    Under a locale collation a plain btree index cannot serve the LIKE of
+    prefix matches. SQLite range scans its index for GLOB as it is.
+    """
+    connection = db.session.connection()
+    if db.engine.dialect.name != "postgresql" or not db.engine.dialect.has_table(connection, "item"):
+        return False
+    definition = connection.execute(
+        text("SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_item_wishlist_id_name'")
+    ).scalar()
+    if definition is not None and "text_pattern_ops" in definition:
+        return False
+    connection.execute(text("DROP INDEX IF EXISTS ix_item_wishlist_id_name"))
+    for index in Item.__table__.indexes:
+        if index.name == "ix_item_wishlist_id_name":
+            index.create(connection)
+    return True
+
+
+def unique_share_positions():
+    """
+    Makes the (wishlist_id, position) index of share unique
+
+    If a position was held twice, the recipient added last keeps it.
+    """
+    connection = db.session.connection()
+    if not db.engine.dialect.has_table(connection, "share"):
+        return False
+    for index in inspect(connection).get_indexes("share"):
+        if index["name"] == "ix_share_wishlist_id_position" and index["unique"]:
+            return False
+    connection.execute(text(
+        "DELETE FROM share WHERE EXISTS (SELECT 1 FROM share AS later "
+        "WHERE later.wishlist_id = share.wishlist_id AND later.position = share.position "
+        "AND later.id > share.id)"
+    ))
+    connection.execute(text("DROP INDEX IF EXISTS ix_share_wishlist_id_position"))
+    for index in Share.__table__.indexes:
+        if index.name == "ix_share_wishlist_id_position":
+            index.create(connection)
+    return True
+
+
+# Migrations in the order they are applied
+MIGRATIONS = (
+    add_wishlist_version,
+    move_shares_to_table,
+    unique_share_positions,
+    cascade_wishlist_deletes,
+    quantity_to_integer,
+    create_rollups,
+    index_item_search,
+    create_lookup_indexes,
+    pattern_index_item_names,
+)
+
+
+def upgrade():
+    """ Applies every migration and returns the names of those that changed something """
+    applied = []
+    try:
+        for migration in MIGRATIONS:
+            if migration():
+                logger.info("Applied migration %s", migration.__name__)
+                applied.append(migration.__name__)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return applied
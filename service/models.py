@@ -3,11 +3,21 @@ Models for Wishlist
 
 All of the models are stored in this module
 """
+import re
 import logging
+from collections import Counter
+from operator import attrgetter, itemgetter
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import selectinload
+from service.serializers import (
+    serialize_wishlist, serialize_item, WISHLIST_COLUMNS, SHARE_FIELDS, ITEM_FIELDS,
+)
 
 logger = logging.getLogger("flask.app")
 
+# Wildcards of a GLOB pattern, matched literally when put in brackets
+GLOB_SPECIAL = re.compile(r"[*?[]")
+
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
@@ -16,7 +26,214 @@ class DataValidationError(Exception):
     pass
 
 
-class Wishlist(db.Model):
+class Record():
+    """
+    A read-only row of the columns a response needs
+
+    Records are built straight from column tuples, so unlike model
+    instances they skip the ORM's attribute instrumentation and are not
+    tracked in the session's identity map. Subclasses name their columns
+    in FIELDS; __slots__ keeps each one small.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, row):
+        for name, value in zip(self.FIELDS, row):
+            setattr(self, name, value)
+
+    def as_dict(self):
+        """ Returns the columns of the record as a dictionary """
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+def _recipients(wishlist):
+    """ Returns the emails a Wishlist or WishlistRecord is shared with, in order """
+    return [share.email for share in sorted(wishlist.shares, key=attrgetter("position"))]
+
+
+def _share_slot(position, writable=False):
+    """ Returns a property for the recipient at a position, i.e. a shared_withN field """
+    def get_email(wishlist):
+        for share in wishlist.shares:
+            if share.position == position:
+                return share.email
+        return None
+
+    def set_email(wishlist, email):
+        wishlist.share_with(position, email)
+
+    return property(get_email, set_email if writable else None)
+
+
+class WishlistRecord(Record):
+    """ A read-only Wishlist with its items and shares as records """
+
+    FIELDS = WISHLIST_COLUMNS
+    __slots__ = FIELDS + ("items", "shares")
+
+    shared_with = property(_recipients)
+    shared_with1 = _share_slot(1)
+    shared_with2 = _share_slot(2)
+    shared_with3 = _share_slot(3)
+
+    def serialize(self):
+        """ Serializes the record like Wishlist.serialize() """
+        return serialize_wishlist(self, self.items)
+
+
+class ShareRecord(Record):
+    """ A read-only Share """
+
+    FIELDS = SHARE_FIELDS
+    __slots__ = FIELDS
+
+
+class ItemRecord(Record):
+    """ A read-only Item """
+
+    FIELDS = ITEM_FIELDS
+    __slots__ = FIELDS
+
+    def serialize(self):
+        """ Serializes the record like Item.serialize() """
+        return serialize_item(self)
+
+
+class PageableMixin():
+    """
+    Keyset pagination over the integer primary key of a model
+
+    Pages are read with WHERE id > after ORDER BY id LIMIT n, so deep pages
+    cost the same as the first one, instead of scanning with an OFFSET.
+    """
+
+    # Read-only record class returned by find_records()
+    RECORD = None
+
+    # Number of rows fetched per query by iter_pages()
+    PAGE_SIZE = 500
+
+    @classmethod
+    def find_page(cls, query=None, after=None, limit=None):
+        """ Returns one page of records ordered by id
+
+        Args:
+            query (Query): an optional filtered query, e.g. from find_by_name
+            after (int): only return records with an id greater than this
+            limit (int): the maximum number of records to return
+        """
+        logger.info("Processing page query after %s limit %s ...", after, limit)
+        if query is None:
+            query = cls.query
+        if after is not None:
+            query = query.filter(cls.id > after)
+        query = query.order_by(cls.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+    @classmethod
+    def record_columns(cls):
+        """ Returns the columns selected into the records of this model """
+        return [cls.__table__.c[name] for name in cls.RECORD.FIELDS]
+
+    @classmethod
+    def find_records(cls, query=None, after=None, limit=None):
+        """ Returns one page like find_page(), as read-only records
+
+        Only the record's columns are selected and no model instances are
+        built, which saves memory and time on large read-only listings.
+        """
+        if query is None:
+            query = cls.query
+        query = query.with_entities(*cls.record_columns())
+        return [cls.RECORD(row) for row in cls.find_page(query, after, limit)]
+
+    @classmethod
+    def iter_pages(cls, query=None, after=None, limit=None, size=None, records=False):
+        """ Yields the records of a query one page at a time
+
+        Only one page of records is held at once, so the caller can stream
+        results of any size with flat memory.
+
+        Args:
+            query (Query): an optional filtered query, e.g. from find_by_name
+            after (int): only return records with an id greater than this
+            limit (int): the maximum number of records to return in total
+            size (int): the number of records per page, PAGE_SIZE by default
+            records (bool): yield read-only records instead of model instances
+        """
+        size = size or cls.PAGE_SIZE
+        find = cls.find_records if records else cls.find_page
+        while limit is None or limit > 0:
+            page_size = size if limit is None else min(size, limit)
+            page = find(query, after, page_size)
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            after = page[-1].id
+            if limit is not None:
+                limit -= len(page)
+
+
+# JSON types of a string column that may be set to null
+NULLABLE_STRING = (str, type(None))
+
+
+class PatchableMixin():
+    """
+    Partial updates of a row with a single UPDATE ... RETURNING
+
+    Only the supplied columns are written and the updated row comes back
+    from the same statement, so a write costs one round trip instead of a
+    SELECT, an UPDATE and a SELECT after the commit. Values computed in SQL
+    (e.g. NOT shared) are atomic under concurrent writes. SQLAlchemy has
+    no RETURNING for SQLite, so there the row is read back with a second
+    statement in the same transaction.
+    """
+
+    # Columns a PATCH may change, with the JSON types they accept
+    PATCHABLE = {}
+
+    @classmethod
+    def patch_values(cls, data):
+        """ Validates the fields of a PATCH body and returns them as column values """
+        if not isinstance(data, dict) or not data:
+            raise DataValidationError(
+                "Invalid {}: body of request must be an object of fields to change".format(cls.__name__)
+            )
+        for name, value in data.items():
+            if name not in cls.PATCHABLE:
+                raise DataValidationError(
+                    "Invalid {}: {} can not be patched, only {}".format(
+                        cls.__name__, name, ", ".join(sorted(cls.PATCHABLE))
+                    )
+                )
+            if not isinstance(value, cls.PATCHABLE[name]):
+                raise DataValidationError("Invalid {}: bad value for {}".format(cls.__name__, name))
+        return {cls.__table__.c[name]: value for name, value in data.items()}
+
+    @classmethod
+    def update_returning(cls, criterion, values):
+        """ Updates the row matching criterion and returns it as a record, or None
+
+        The UPDATE joins the caller's transaction
+        """
+        columns = cls.record_columns()
+        statement = cls.__table__.update().where(criterion).values(values)
+        if db.engine.dialect.name == "postgresql":
+            row = db.session.execute(statement.returning(*columns)).first()
+        elif db.session.execute(statement).rowcount:
+            row = db.session.query(*columns).filter(criterion).first()
+        else:
+            row = None
+        return cls.RECORD(row) if row is not None else None
+
+
+class Wishlist(PatchableMixin, PageableMixin, db.Model):
     """
     Class that represents a Wishlist
     """
@@ -25,13 +242,30 @@ class Wishlist(db.Model):
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(63))
-    email = db.Column(db.String(32))
-    shared_with1 = db.Column(db.String(63))
-    shared_with2 = db.Column(db.String(63))
-    shared_with3 = db.Column(db.String(63))
-    shared = db.Column(db.Boolean, default_value=False)
-    items = db.relationship('Item', backref='wishlist', lazy=True)
+    name = db.Column(db.String(63), index=True)
+    # active_history loads the old email on change, which the rollups need
+    email = db.column_property(db.Column(db.String(32), index=True), active_history=True)
+    shared = db.Column(db.Boolean, default=False)
+    # Bumped by every change to the Wishlist or its Items, used for ETags
+    version = db.Column(db.Integer, nullable=False, default=1)
+    # passive_deletes leaves the rows of a deleted Wishlist to ON DELETE CASCADE
+    items = db.relationship(
+        'Item', backref='wishlist', lazy=True, order_by='Item.id',
+        cascade='all', passive_deletes=True,
+    )
+    shares = db.relationship(
+        'Share', backref='wishlist', lazy=True, order_by='Share.position',
+        cascade='all, delete-orphan', passive_deletes=True,
+    )
+
+    # The first three recipients, as the fields they used to be stored in
+    shared_with1 = _share_slot(1, writable=True)
+    shared_with2 = _share_slot(2, writable=True)
+    shared_with3 = _share_slot(3, writable=True)
+
+    RECORD = WishlistRecord
+
+    PATCHABLE = {"name": NULLABLE_STRING, "email": NULLABLE_STRING, "shared": bool}
 
     def __repr__(self):
         return "<Wishlist %r id=[%s]>" % (self.name, self.id)
@@ -50,6 +284,7 @@ class Wishlist(db.Model):
         Updates a Wishlist to the database
         """
         logger.info("Saving %s", self.name)
+        self.version = Wishlist.version + 1  # incremented in SQL, not in Python
         db.session.commit()
 
     def delete(self):
@@ -58,22 +293,38 @@ class Wishlist(db.Model):
         db.session.delete(self)
         db.session.commit()
 
+    @property
+    def shared_with(self):
+        """ The emails the Wishlist is shared with, in order """
+        return _recipients(self)
+
+    @shared_with.setter
+    def shared_with(self, emails):
+        if any(email is not None and not isinstance(email, str) for email in emails):
+            raise DataValidationError("Invalid Wishlist: shared_with must be a list of emails")
+        emails = [email for email in emails if email]
+        for position, email in enumerate(emails, 1):
+            self.share_with(position, email)
+        for share in list(self.shares):
+            if share.position > len(emails):
+                self.shares.remove(share)
+
+    def share_with(self, position, email):
+        """ Shares the Wishlist with an email at a position, or unshares it if empty """
+        if email is not None and not isinstance(email, str):
+            raise DataValidationError("Invalid Wishlist: shared_with{} must be an email".format(position))
+        share = next((share for share in self.shares if share.position == position), None)
+        if not email:
+            if share is not None:
+                self.shares.remove(share)
+        elif share is None:
+            self.shares.append(Share(position=position, email=email))
+        else:
+            share.email = email
+
     def serialize(self):
         """ Serializes a Wishlist into a dictionary """
-        items = []
-        for i in self.items:
-            items.append(i.serialize())
-
-        return {
-            "id": self.id,
-            "name": self.name,
-            "email": self.email,
-            "shared_with1":self.shared_with1,
-            "shared_with2":self.shared_with2,
-            "shared_with3":self.shared_with3,
-            "shared":self.shared,
-            "items": items
-        }
+        return serialize_wishlist(self, self.items)
 
     def deserialize(self, data):
         """
@@ -86,12 +337,18 @@ class Wishlist(db.Model):
             # self.id = data["id"]
             self.name = data["name"]
             self.email = data["email"]
-            if 'shared_with1' in data:
-                self.shared_with1 = data["shared_with1"]
-            if 'shared_with2' in data:
-                self.shared_with2 = data["shared_with2"]
-            if 'shared_with3' in data:
-                self.shared_with3 = data["shared_with3"]
+            # the shared_with list wins over the legacy shared_withN fields
+            if 'shared_with' in data:
+                if not isinstance(data["shared_with"], list):
+                    raise DataValidationError("Invalid Wishlist: shared_with must be a list")
+                self.shared_with = data["shared_with"]
+            else:
+                if 'shared_with1' in data:
+                    self.shared_with1 = data["shared_with1"]
+                if 'shared_with2' in data:
+                    self.shared_with2 = data["shared_with2"]
+                if 'shared_with3' in data:
+                    self.shared_with3 = data["shared_with3"]
             if 'shared' in data:
                 self.shared = data["shared"]
 
@@ -103,6 +360,53 @@ class Wishlist(db.Model):
             )
         return self
 
+    @classmethod
+    def patch(cls, wishlist_id, data):
+        """ Updates only the given fields of a Wishlist in one statement
+
+        Args:
+            wishlist_id (int): the id of the Wishlist to change
+            data (dict): the fields to change, some of PATCHABLE
+
+        Returns the updated WishlistRecord, without items or shares, or
+        None if there is no such Wishlist
+        """
+        logger.info("Patching %s", wishlist_id)
+        values = cls.patch_values(data)
+        values[cls.version] = cls.version + 1
+        old = None
+        try:
+            if cls.__table__.c.email in values:
+                # the old email leaves the rollups; the row stays locked until the commit
+                old = db.session.query(cls.email).filter(cls.id == wishlist_id).with_for_update().first()
+            record = cls.update_returning(cls.id == wishlist_id, values)
+            if record is not None and old is not None:
+                Rollup.adjust(Counter({(Rollup.EMAIL, old.email): -1, (Rollup.EMAIL, record.email): 1}))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return record
+
+    @classmethod
+    def toggle_shared(cls, wishlist_id):
+        """ Flips the shared flag of a Wishlist in SQL, so concurrent toggles never get lost
+
+        Returns the updated WishlistRecord, or None if there is no such Wishlist
+        """
+        logger.info("Toggling shared of %s", wishlist_id)
+        values = {
+            cls.shared: db.not_(db.func.coalesce(cls.shared, False)),
+            cls.version: cls.version + 1,
+        }
+        try:
+            record = cls.update_returning(cls.id == wishlist_id, values)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return record
+
     @classmethod
     def init_db(cls, app):
         """ Initializes the database session """
@@ -113,22 +417,124 @@ class Wishlist(db.Model):
         app.app_context().push()
         db.create_all()  # make our sqlalchemy tables
 
+    @classmethod
+    def delete_by_id(cls, wishlist_id):
+        """ Deletes a Wishlist with its items and shares, without loading them
+
+        On Postgres this is a single DELETE whose children go through ON
+        DELETE CASCADE; the ids of the items are read in the same statement,
+        from the snapshot it started with. SQLite does not enforce foreign
+        keys by default, so there the children are deleted first.
+
+        Returns the ids of the deleted items
+        """
+        logger.info("Deleting %s", wishlist_id)
+        try:
+            Rollup.remove_wishlist(wishlist_id)
+            if db.engine.dialect.name == "postgresql":
+                deleted = cls.__table__.delete().where(cls.id == wishlist_id).returning(cls.id).cte("deleted")
+                rows = db.session.execute(
+                    db.select([Item.id]).where(Item.wishlist_id.in_(db.select([deleted.c.id])))
+                )
+                item_ids = [row[0] for row in rows]
+            else:
+                rows = db.session.query(Item.id).filter(Item.wishlist_id == wishlist_id)
+                item_ids = [row[0] for row in rows]
+                for model in (Item, Share):
+                    db.session.execute(model.__table__.delete().where(model.wishlist_id == wishlist_id))
+                db.session.execute(cls.__table__.delete().where(cls.id == wishlist_id))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return item_ids
+
     @classmethod
     def remove_all(cls):
-        """ Removes all documents from the database (use for testing)  """
-        cls.query.delete()
+        """ Removes all documents from the database (use for testing)
+
+        TRUNCATE on Postgres takes the same time for any number of rows.
+        SQLite has no TRUNCATE, but a DELETE without a WHERE clause gets
+        its truncate optimization, which drops the pages of the table
+        instead of deleting row by row. A table with triggers does not get
+        it, so the search triggers of item are dropped for the DELETE and
+        the search index is emptied with one command instead.
+        """
+        logger.info("Removing all Wishlists")
+        tables = [model.__table__.name for model in (Item, Share, cls, Rollup)]
+        try:
+            if db.engine.dialect.name == "postgresql":
+                db.session.execute("TRUNCATE {}".format(", ".join(tables)))
+            else:
+                # pysqlite only opens a transaction before DML and would
+                # autocommit the DROP TRIGGERs, so a DELETE goes first: a
+                # rollback then brings the triggers back
+                for table in reversed(tables):
+                    if table == Item.__tablename__:
+                        for trigger in SQLITE_SEARCH_TRIGGERS:
+                            db.session.execute("DROP TRIGGER IF EXISTS {}".format(trigger))
+                    db.session.execute("DELETE FROM {}".format(table))
+                create_search_index(db.session.connection())
+                db.session.execute("INSERT INTO item_search (item_search) VALUES ('delete-all')")
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
     
     @classmethod
     def all(cls):
         """ Returns all of the Wishlist in the database """
         logger.info("Processing all Wishlist")
-        return cls.query.all()
+        return cls.with_items().all()
+
+    @classmethod
+    def find_records(cls, query=None, after=None, limit=None):
+        """ Returns one page of read-only WishlistRecords with their items and shares
+
+        The items and shares of the whole page are read with two extra
+        SELECTs per PAGE_SIZE Wishlists, like with_items() does for model
+        instances.
+        """
+        records = super().find_records(query, after, limit)
+        by_id = {}
+        for record in records:
+            record.items = []
+            record.shares = []
+            by_id[record.id] = record
+        ids = list(by_id)
+        for start in range(0, len(ids), cls.PAGE_SIZE):
+            chunk = ids[start:start + cls.PAGE_SIZE]
+            rows = (
+                db.session.query(*Item.record_columns())
+                .filter(Item.wishlist_id.in_(chunk))
+                .order_by(Item.id)
+            )
+            for row in rows:
+                by_id[row.wishlist_id].items.append(ItemRecord(row))
+            rows = (
+                db.session.query(*Share.record_columns())
+                .filter(Share.wishlist_id.in_(chunk))
+                .order_by(Share.wishlist_id, Share.position)
+            )
+            for row in rows:
+                by_id[row.wishlist_id].shares.append(ShareRecord(row))
+        return records
+
+    @classmethod
+    def with_items(cls):
+        """ Returns a query that batch loads the items and shares of every Wishlist
+
+        All the items of the Wishlists a query returns are fetched with one
+        extra SELECT ... WHERE wishlist_id IN (...) instead of one SELECT per
+        Wishlist when serialize() walks the items, and so are the shares.
+        """
+        return cls.query.options(selectinload(cls.items), selectinload(cls.shares))
 
     @classmethod
     def find(cls, by_id):
         """ Finds a Wishlist by its ID """
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.get(by_id)
+        return cls.with_items().get(by_id)
 
     @classmethod
     def find_or_404(cls, by_id):
@@ -136,6 +542,28 @@ class Wishlist(db.Model):
         logger.info("Processing lookup or 404 for id %s ...", by_id)
         return cls.query.get_or_404(by_id)
 
+    @classmethod
+    def find_version(cls, by_id):
+        """ Returns the version of a Wishlist, or None if it does not exist
+
+        Only the version column is read, not the Wishlist or its items
+        """
+        logger.info("Processing version lookup for id %s ...", by_id)
+        return db.session.query(cls.version).filter(cls.id == by_id).scalar()
+
+    @classmethod
+    def touch(cls, *wishlist_ids):
+        """ Bumps the version of Wishlists whose items changed
+
+        The UPDATE joins the caller's transaction, so it is committed
+        together with the item change
+        """
+        ids = {wishlist_id for wishlist_id in wishlist_ids if wishlist_id is not None}
+        if ids:
+            cls.query.filter(cls.id.in_(ids)).update(
+                {cls.version: cls.version + 1}, synchronize_session=False
+            )
+
     @classmethod
     def find_by_name(cls, name):
         """ Returns all Wishlist with the given name
@@ -144,7 +572,7 @@ class Wishlist(db.Model):
             name (string): the name of the Wishlist you want to match
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name)
+        return cls.with_items().filter(cls.name == name)
     
     @classmethod
     def find_by_id(cls, id):
@@ -154,7 +582,7 @@ class Wishlist(db.Model):
             id (string): the id of the Wishlist you want to match
         """
         logger.info("Processing id query for %s ...", id)
-        return cls.query.filter(cls.id == id)
+        return cls.with_items().filter(cls.id == id)
 
     @classmethod
     def find_by_email(cls, email):
@@ -164,23 +592,82 @@ class Wishlist(db.Model):
             name (string): the name of the Wishlist you want to match
         """
         logger.info("Processing name query for %s ...", email)
-        return cls.query.filter(cls.email == email)
+        return cls.with_items().filter(cls.email == email)
+
+    @classmethod
+    def find_by_shared_with(cls, email):
+        """ Returns all Wishlist shared with the given email
+
+        The email index of the share table finds the Wishlists, instead of
+        a scan of every Wishlist
+
+        Args:
+            email (string): the email the Wishlists are shared with
+        """
+        logger.info("Processing shared with query for %s ...", email)
+        shared = db.session.query(Share.wishlist_id).filter(Share.email == email)
+        return cls.with_items().filter(cls.id.in_(shared))
+
+######################################################################
+#  S H A R E   M O D E L
+######################################################################
+class Share(PageableMixin, db.Model):
+    """
+    Class that represents a recipient a Wishlist is shared with
+    """
+
+    # Table Schema
+    id = db.Column(db.Integer, primary_key=True)
+    wishlist_id = db.Column(db.Integer, db.ForeignKey('wishlist.id', ondelete='CASCADE'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)  # 1 for the first recipient
+    email = db.Column(db.String(63), nullable=False, index=True)
+
+    RECORD = ShareRecord
+
+    # Loads the shares of a Wishlist in order, and holds one recipient per position
+    __table_args__ = (db.Index("ix_share_wishlist_id_position", "wishlist_id", "position", unique=True),)
+
+    def __repr__(self):
+        return "<Share %r position=[%s] wishlist[%s]>" % (self.email, self.position, self.wishlist_id)
 
 ######################################################################
 #  I T E M   M O D E L
 ######################################################################
-class Item(db.Model):
+class Item(PatchableMixin, PageableMixin, db.Model):
     """
     Class that represents an Item
     """
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    wishlist_id = db.Column(db.Integer, db.ForeignKey('wishlist.id'), nullable=False)
+    # active_history loads the old wishlist_id and sku on change, which the rollups need
+    wishlist_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('wishlist.id', ondelete='CASCADE'), nullable=False),
+        active_history=True,
+    )
     name = db.Column(db.String(64)) # e.g., toothbrush, book, phone
-    sku = db.Column(db.String(64))
+    sku = db.column_property(db.Column(db.String(64), index=True), active_history=True)
     description = db.Column(db.String(64))
-    quantity = db.Column(db.String(64))
+    quantity = db.Column(db.Integer)
+
+    RECORD = ItemRecord
+
+    # quantity is checked by parse_quantity()
+    PATCHABLE = {
+        "name": NULLABLE_STRING, "sku": NULLABLE_STRING,
+        "description": NULLABLE_STRING, "quantity": (int, str, type(None)),
+    }
+
+    # Largest quantity an INTEGER column holds
+    MAX_QUANTITY = 2 ** 31 - 1
+
+    # Ways find_by_wishlist can match an Item name
+    NAME_MATCHES = ("exact", "icase", "prefix")
+
+    # The (wishlist_id, name) index also serves lookups on wishlist_id alone
+    __table_args__ = (
+        db.Index("ix_item_wishlist_id_name", "wishlist_id", "name", postgresql_ops={"name": "text_pattern_ops"}),
+    )
 
     def __repr__(self):
         return "<Item %r id=[%s] wishlist[%s]>" % (self.name, self.id, self.wishlist_id)
@@ -190,14 +677,7 @@ class Item(db.Model):
 
     def serialize(self):
         """ Serializes an Item into a dictionary """
-        return {
-            "id": self.id,
-            "wishlist_id": self.wishlist_id,
-            "name": self.name,
-            "sku": self.sku,
-            "description": self.description,
-            "quantity": self.quantity,
-        }
+        return serialize_item(self)
 
     def deserialize(self, data):
         """
@@ -210,7 +690,7 @@ class Item(db.Model):
             self.name = data["name"]
             self.sku = data["sku"]
             self.description = data["description"]
-            self.quantity = data["quantity"]
+            self.quantity = self.parse_quantity(data["quantity"])
         except KeyError as error:
             raise DataValidationError("Invalid Item: missing " + error.args[0])
         except TypeError as error:
@@ -224,11 +704,131 @@ class Item(db.Model):
         Updates a Wishlist to the database
         """
         logger.info("Saving %s", self.name)
+        # bump the Wishlist the Item was in and the one it is in now
+        Wishlist.touch(*db.inspect(self).attrs.wishlist_id.history.sum())
         db.session.commit()
+
+    @classmethod
+    def create_all(cls, items):
+        """
+        Adds a batch of Items to the database with one INSERT and one commit
+
+        The rows go out as a single multi-row INSERT ... VALUES statement
+        instead of one INSERT per Item, and the new ids are set on the Items
+
+        Args:
+            items (list): the deserialized Items to insert
+        """
+        logger.info("Creating %d items", len(items))
+        if not items:
+            return items
+        table = cls.__table__
+        rows = [
+            {
+                "wishlist_id": item.wishlist_id,
+                "name": item.name,
+                "sku": item.sku,
+                "description": item.description,
+                "quantity": item.quantity,
+            }
+            for item in items
+        ]
+        statement = table.insert().values(rows)
+        try:
+            if db.engine.dialect.name == "postgresql":
+                result = db.session.execute(statement.returning(table.c.id))
+                # ids are drawn from the sequence in VALUES order
+                ids = sorted(row[0] for row in result)
+            else:
+                # SQLite gives the rows of one INSERT consecutive rowids
+                last_id = db.session.execute(statement).lastrowid
+                ids = range(last_id - len(rows) + 1, last_id + 1)
+            Wishlist.touch(*[row["wishlist_id"] for row in rows])
+            Rollup.adjust(Rollup.item_deltas(items))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for item, item_id in zip(items, ids):
+            item.id = item_id
+        return items
     
+    @classmethod
+    def parse_quantity(cls, value):
+        """ Returns a quantity as an integer, also accepting the digit strings older clients send """
+        if value is None:
+            return None
+        if isinstance(value, str) and value.strip().isdecimal():
+            value = int(value)
+        if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= cls.MAX_QUANTITY:
+            raise DataValidationError(
+                "Invalid Item: quantity must be a whole number from 0 to {}".format(cls.MAX_QUANTITY)
+            )
+        return value
+
+    @classmethod
+    def patch_values(cls, data):
+        """ Validates the fields of a PATCH body, with the quantity as an integer """
+        values = super().patch_values(data)
+        quantity = cls.__table__.c.quantity
+        if quantity in values:
+            values[quantity] = cls.parse_quantity(values[quantity])
+        return values
+
+    @classmethod
+    def patch(cls, wishlist_id, item_id, data):
+        """ Updates only the given fields of an Item in one statement
+
+        The version of its Wishlist is bumped by the same statement on
+        Postgres, with the UPDATEs chained in a WITH query
+
+        Args:
+            wishlist_id (int): the id of the Wishlist the Item is in
+            item_id (int): the id of the Item to change
+            data (dict): the fields to change, some of PATCHABLE
+
+        Returns the updated ItemRecord, or None if the Wishlist has no such Item
+        """
+        logger.info("Patching item %s", item_id)
+        values = cls.patch_values(data)
+        criterion = db.and_(cls.id == item_id, cls.wishlist_id == wishlist_id)
+        old = None
+        try:
+            if cls.__table__.c.sku in values:
+                # the old sku leaves the rollups; the row stays locked until the commit
+                old = db.session.query(cls.sku).filter(criterion).with_for_update().first()
+            if db.engine.dialect.name == "postgresql":
+                updated = (
+                    cls.__table__.update().where(criterion).values(values)
+                    .returning(*cls.record_columns()).cte("updated")
+                )
+                bumped = (
+                    Wishlist.__table__.update().where(Wishlist.id == updated.c.wishlist_id)
+                    .values({Wishlist.version: Wishlist.version + 1})
+                    .returning(Wishlist.id).cte("bumped")
+                )
+                row = db.session.execute(
+                    db.select(list(updated.c)).select_from(
+                        updated.join(bumped, bumped.c.id == updated.c.wishlist_id)
+                    )
+                ).first()
+                record = cls.RECORD(row) if row is not None else None
+            else:
+                record = cls.update_returning(criterion, values)
+                if record is not None:
+                    Wishlist.touch(wishlist_id)
+            if record is not None and old is not None:
+                Rollup.adjust(Counter({(Rollup.SKU, old.sku): -1, (Rollup.SKU, record.sku): 1}))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return record
+
     def delete(self):
         """ Removes a Item from the data store """
         logger.info("Deleting %s", self.name)
+        Wishlist.touch(self.wishlist_id)
         db.session.delete(self)
         db.session.commit()
 
@@ -280,6 +880,138 @@ class Item(db.Model):
         logger.info("Processing id query for %s ...", id)
         return cls.query.filter(cls.id == id)
 
+    @classmethod
+    def find_by_wishlist(cls, wishlist_id, name=None, match="exact", sku=None):
+        """ Returns all Items in the given Wishlist, optionally filtered
+
+        Every filter runs in the database; exact and prefix name matches
+        can use the (wishlist_id, name) index
+
+        Args:
+            wishlist_id (int): the id of the Wishlist the Items belong to
+            name (string): only return Items whose name matches this
+            match (string): how to match the name, one of NAME_MATCHES
+            sku (string): only return Items with this sku
+        """
+        logger.info("Processing wishlist query for %s ...", wishlist_id)
+        query = cls.query.filter(cls.wishlist_id == wishlist_id)
+        if name:
+            if match == "exact":
+                query = query.filter(cls.name == name)
+            elif match == "icase":
+                query = query.filter(db.func.lower(cls.name) == name.lower())
+            elif match == "prefix":
+                if db.engine.dialect.name == "sqlite":
+                    # SQLite's LIKE ignores case, GLOB does not; both can range scan the index
+                    query = query.filter(cls.name.op("GLOB")(GLOB_SPECIAL.sub(r"[\g<0>]", name) + "*"))
+                else:
+                    # text_pattern_ops lets the index serve LIKE under any collation
+                    query = query.filter(cls.name.startswith(name, autoescape=True))
+            else:
+                raise DataValidationError("Invalid name match: " + str(match))
+        if sku:
+            query = query.filter(cls.sku == sku)
+        return query
+
+    @classmethod
+    def search(cls, text, wishlist_id=None, email=None, after=None, limit=None):
+        """ Returns the Items whose name or description contain every word of text, best match first
+
+        The words are looked up in the full-text index of the database (see
+        create_search_index), with stemming, so "mugs" finds "mug". Lower
+        ranks are better matches; pages are read by keyset on (rank, id).
+
+        Args:
+            text (string): the words to search for
+            wishlist_id (int): only search the Items of this Wishlist
+            email (string): only search the Wishlists of this email
+            after (tuple): only return matches ranked after this (rank, id)
+            limit (int): the maximum number of matches to return
+
+        Without wishlist_id or email only the shared Wishlists are searched.
+        Returns a list of (ItemRecord, rank) pairs
+        """
+        logger.info("Processing search for %s ...", text)
+        words = SEARCH_WORD.findall(text or "")
+        if not words:
+            raise DataValidationError("Invalid search: q must contain a word")
+        if db.engine.dialect.name == "postgresql":
+            document = db.literal_column(SEARCH_DOCUMENT)
+            tsquery = db.func.plainto_tsquery(db.literal_column(SEARCH_CONFIG), " ".join(words))
+            # ts_rank is higher for better matches, bm25 lower; double precision keeps cursors exact
+            rank = -db.cast(db.func.ts_rank(document, tsquery), db.Float(53))
+            query = db.session.query(*cls.record_columns(), rank).filter(document.op("@@")(tsquery))
+        else:
+            index = db.table("item_search", db.column("rowid"))
+            rank = db.func.bm25(db.literal_column("item_search"))
+            query = (
+                db.session.query(*cls.record_columns(), rank)
+                .select_from(cls.__table__.join(index, index.c.rowid == cls.id))
+                # each word is quoted, so FTS5 query syntax in text is searched for as is
+                .filter(db.literal_column("item_search").match(" ".join('"{}"'.format(w) for w in words)))
+            )
+        if wishlist_id is not None:
+            query = query.filter(cls.wishlist_id == wishlist_id)
+        elif email is not None:
+            query = query.filter(cls.wishlist_id.in_(db.session.query(Wishlist.id).filter(Wishlist.email == email)))
+        else:
+            query = query.filter(cls.wishlist_id.in_(db.session.query(Wishlist.id).filter(Wishlist.shared.is_(True))))
+        if after is not None:
+            after_rank, after_id = after
+            query = query.filter(db.or_(rank > after_rank, db.and_(rank == after_rank, cls.id > after_id)))
+        query = query.order_by(rank, cls.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return [(cls.RECORD(row[:-1]), row[-1]) for row in query]
+
+    @classmethod
+    def totals_by_wishlist(cls, email=None):
+        """ Returns the number of Items and their total quantity in every Wishlist
+
+        COUNT and SUM run in the database, grouped by Wishlist, so only one
+        row per Wishlist comes back. Wishlists without Items total 0.
+
+        Args:
+            email (string): only total the Wishlists of this email
+        """
+        logger.info("Processing totals by wishlist ...")
+        query = (
+            db.session.query(
+                Wishlist.id.label("wishlist_id"),
+                db.func.count(cls.id).label("items"),
+                db.func.coalesce(db.func.sum(cls.quantity), 0).label("quantity"),
+            )
+            .outerjoin(cls, cls.wishlist_id == Wishlist.id)
+            .group_by(Wishlist.id)
+            .order_by(Wishlist.id)
+        )
+        if email:
+            query = query.filter(Wishlist.email == email)
+        return query
+
+    @classmethod
+    def totals_by_email(cls, email=None):
+        """ Returns the number of Wishlists and Items and the total quantity of every email
+
+        Args:
+            email (string): only total the Wishlists of this email
+        """
+        logger.info("Processing totals by email ...")
+        query = (
+            db.session.query(
+                Wishlist.email.label("email"),
+                db.func.count(db.distinct(Wishlist.id)).label("wishlists"),
+                db.func.count(cls.id).label("items"),
+                db.func.coalesce(db.func.sum(cls.quantity), 0).label("quantity"),
+            )
+            .outerjoin(cls, cls.wishlist_id == Wishlist.id)
+            .group_by(Wishlist.email)
+            .order_by(Wishlist.email)
+        )
+        if email:
+            query = query.filter(Wishlist.email == email)
+        return query
+
     @classmethod
     def find_by_sku(cls, sku):
         """ Returns the Item with the given sku
@@ -289,3 +1021,262 @@ class Item(db.Model):
         """
         logger.info("Processing sku query for %s ...", sku)
         return cls.query.filter(cls.sku == sku)
+
+######################################################################
+#  F U L L - T E X T   S E A R C H
+######################################################################
+# Words of a search; anything else is a separator
+SEARCH_WORD = re.compile(r"\w+")
+
+# Text search configuration and document of the Postgres GIN index. The
+# queries of Item.search() repeat the same expression, so they can use it.
+SEARCH_CONFIG = "'english'"
+SEARCH_DOCUMENT = "to_tsvector({}, coalesce(name, '') || ' ' || coalesce(description, ''))".format(SEARCH_CONFIG)
+
+POSTGRES_SEARCH_INDEX = (
+    "CREATE INDEX IF NOT EXISTS ix_item_search ON item USING GIN ({})".format(SEARCH_DOCUMENT),
+)
+
+# SQLite has no such index, so an FTS5 table indexes the item rows, and
+# triggers keep it in step with every INSERT, UPDATE and DELETE of item
+SQLITE_SEARCH_TRIGGERS = ("item_search_insert", "item_search_delete", "item_search_update")
+SQLITE_SEARCH_INDEX = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS item_search USING fts5("
+    "name, description, content='item', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS item_search_insert AFTER INSERT ON item BEGIN "
+    "INSERT INTO item_search (rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS item_search_delete AFTER DELETE ON item BEGIN "
+    "INSERT INTO item_search (item_search, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS item_search_update AFTER UPDATE OF id, name, description ON item BEGIN "
+    "INSERT INTO item_search (item_search, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO item_search (rowid, name, description) VALUES (new.id, new.name, new.description); END",
+)
+
+
+def create_search_index(connection):
+    """ Creates the full-text index of the item table, if it does not exist yet """
+    if connection.dialect.name == "postgresql":
+        statements = POSTGRES_SEARCH_INDEX
+    else:
+        statements = SQLITE_SEARCH_INDEX
+    for statement in statements:
+        connection.execute(db.text(statement))
+
+
+@db.event.listens_for(Item.__table__, "after_create")
+def _create_search_index(table, connection, **kwargs):
+    create_search_index(connection)
+
+
+@db.event.listens_for(Item.__table__, "before_drop")
+def _drop_search_index(table, connection, **kwargs):
+    # the Postgres index and the SQLite triggers go with the table
+    if connection.dialect.name == "sqlite":
+        connection.execute(db.text("DROP TABLE IF EXISTS item_search"))
+
+
+######################################################################
+#  R O L L U P   M O D E L
+######################################################################
+def _history_deltas(deltas, instance, *counted):
+    """ Moves the counts of changed attributes from their old values to their new ones """
+    attrs = db.inspect(instance).attrs
+    for kind, attribute in counted:
+        history = attrs[attribute].history
+        for value in history.deleted or ():
+            deltas[kind, value] -= 1
+        for value in history.added or ():
+            deltas[kind, value] += 1
+
+
+class Rollup(db.Model):
+    """
+    A running count behind /stats, kept up to date by every write
+
+    Each row counts one thing: the wishlists of an email, the items of a
+    wishlist or of a SKU, or all wishlists and items. Every flush of
+    Wishlists and Items, and every bulk statement of the model methods,
+    adjusts the counts in its own transaction, so /stats reads a handful
+    of rows instead of scanning the tables. rebuild() recomputes every
+    count from scratch.
+
+    Every Wishlist or Item created or deleted updates a total row, so
+    those writes queue on its row lock until the writer before them
+    commits.
+    """
+
+    # Kinds of counts, and what their names are
+    TOTAL = "total"  # "wishlists" or "items"
+    EMAIL = "email"  # the email of the Wishlists counted
+    WISHLIST = "wishlist"  # the id of the Wishlist whose Items are counted
+    SKU = "sku"  # the sku of the Items counted
+
+    # Table Schema
+    kind = db.Column(db.String(16), primary_key=True)
+    name = db.Column(db.String(64), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    # Reads the largest counts of a kind in order
+    __table_args__ = (db.Index("ix_rollup_kind_count", "kind", count.desc(), "name"),)
+
+    # Adds to a count, creating it if needed (PostgreSQL 9.5+ and SQLite 3.24+)
+    UPSERT = db.text(
+        "INSERT INTO rollup (kind, name, count) VALUES (:kind, :name, :delta) "
+        "ON CONFLICT (kind, name) DO UPDATE SET count = rollup.count + excluded.count"
+    )
+
+    def __repr__(self):
+        return "<Rollup %s %r count=[%s]>" % (self.kind, self.name, self.count)
+
+    @classmethod
+    def adjust(cls, deltas):
+        """ Adds a Counter of {(kind, name): delta} to the counts, in the caller's transaction
+
+        The rows are always locked in (kind, name) order, so two
+        transactions touching the same counts can not deadlock
+        """
+        rows = sorted(
+            (
+                {"kind": kind, "name": str(name), "delta": delta}
+                for (kind, name), delta in deltas.items()
+                if delta and name is not None
+            ),
+            key=itemgetter("kind", "name"),
+        )
+        if rows:
+            db.session.execute(cls.UPSERT, rows)
+
+    @classmethod
+    def item_deltas(cls, items, sign=1):
+        """ Returns the changes to the counts when Items are added, or removed with sign -1 """
+        deltas = Counter()
+        for item in items:
+            deltas[cls.TOTAL, "items"] += sign
+            deltas[cls.WISHLIST, item.wishlist_id] += sign
+            deltas[cls.SKU, item.sku] += sign
+        return deltas
+
+    @classmethod
+    def flush_deltas(cls, session):
+        """ Returns the changes to the counts made by the Wishlists and Items of a flush
+
+        Called once their rows are written, when the new ones have ids but
+        the session still holds what was added, changed and deleted. The
+        Items of a deleted Wishlist were counted by remove_wishlist().
+        """
+        deltas = Counter()
+        for instance in session.new:
+            if isinstance(instance, Wishlist):
+                deltas[cls.TOTAL, "wishlists"] += 1
+                deltas[cls.EMAIL, instance.email] += 1
+            elif isinstance(instance, Item):
+                deltas.update(cls.item_deltas([instance]))
+        for instance in session.dirty:
+            if isinstance(instance, Wishlist):
+                _history_deltas(deltas, instance, (cls.EMAIL, "email"))
+            elif isinstance(instance, Item):
+                _history_deltas(deltas, instance, (cls.WISHLIST, "wishlist_id"), (cls.SKU, "sku"))
+        deleted = {instance.id for instance in session.deleted if isinstance(instance, Wishlist)}
+        for instance in session.deleted:
+            if isinstance(instance, Item) and instance.wishlist_id not in deleted:
+                deltas.update(cls.item_deltas([instance], -1))
+        return deltas
+
+    @classmethod
+    def remove_wishlist(cls, wishlist_id):
+        """ Takes a Wishlist and its Items out of the counts, before they are deleted
+
+        The Items are counted with one GROUP BY query. On PostgreSQL the
+        Wishlist row stays locked until the commit, so no Item can be added
+        to it in the meantime.
+        """
+        wishlist = db.session.query(Wishlist.email).filter(Wishlist.id == wishlist_id).with_for_update().first()
+        if wishlist is None:
+            return
+        deltas = Counter({(cls.TOTAL, "wishlists"): -1, (cls.EMAIL, wishlist.email): -1})
+        rows = (
+            db.session.query(Item.sku, db.func.count())
+            .filter(Item.wishlist_id == wishlist_id)
+            .group_by(Item.sku)
+        )
+        for sku, count in rows:
+            deltas[cls.TOTAL, "items"] -= count
+            deltas[cls.SKU, sku] -= count
+        cls.adjust(deltas)
+        db.session.execute(
+            cls.__table__.delete().where(db.and_(cls.kind == cls.WISHLIST, cls.name == str(wishlist_id)))
+        )
+
+    @classmethod
+    def recount(cls):
+        """ Recomputes every count from the wishlist and item tables, in the caller's transaction
+
+        Each kind is one INSERT ... SELECT ... GROUP BY, so no rows are
+        read into Python
+        """
+        table = cls.__table__
+        selects = [
+            db.select([db.literal(cls.TOTAL), db.literal("wishlists"), db.func.count(Wishlist.id)]),
+            db.select([db.literal(cls.TOTAL), db.literal("items"), db.func.count(Item.id)]),
+            db.select([db.literal(cls.EMAIL), Wishlist.email, db.func.count()])
+            .where(Wishlist.email.isnot(None)).group_by(Wishlist.email),
+            db.select([db.literal(cls.WISHLIST), db.cast(Item.wishlist_id, db.String), db.func.count()])
+            .group_by(Item.wishlist_id),
+            db.select([db.literal(cls.SKU), Item.sku, db.func.count()])
+            .where(Item.sku.isnot(None)).group_by(Item.sku),
+        ]
+        db.session.execute(table.delete())
+        for select in selects:
+            db.session.execute(table.insert().from_select(["kind", "name", "count"], select))
+
+    @classmethod
+    def rebuild(cls):
+        """ Recomputes every count and commits them """
+        logger.info("Rebuilding the rollups")
+        try:
+            cls.recount()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def total(cls, name):
+        """ Returns the number of all Wishlists or Items """
+        count = db.session.query(cls.count).filter(cls.kind == cls.TOTAL, cls.name == name).scalar()
+        return count or 0
+
+    @classmethod
+    def top(cls, kind, limit):
+        """ Returns the names and counts of the largest counts of a kind, largest first
+
+        Args:
+            kind (string): one of EMAIL, WISHLIST or SKU
+            limit (int): the number of counts to return
+        """
+        return (
+            db.session.query(cls.name, cls.count)
+            .filter(cls.kind == kind, cls.count > 0)
+            .order_by(cls.count.desc(), cls.name)
+            .limit(limit)
+            .all()
+        )
+
+
+######################################################################
+#  R O L L U P   M A I N T E N A N C E
+######################################################################
+@db.event.listens_for(db.session, "before_flush")
+def _remove_deleted_wishlists(session, flush_context, instances):
+    """ Takes the Wishlists a flush deletes out of the counts, while their Items are still there """
+    for instance in session.deleted:
+        if isinstance(instance, Wishlist):
+            Rollup.remove_wishlist(instance.id)
+
+
+@db.event.listens_for(db.session, "after_flush")
+def _count_flushed_rows(session, flush_context):
+    """ Adds what a flush wrote to the counts, in the same transaction """
+    Rollup.adjust(Rollup.flush_deltas(session))
@@ -0,0 +1,134 @@
+"""
+Database Connection Pool Telemetry
+
+Records how long requests wait to check a connection out of the
+SQLAlchemy pool and reports live pool statistics, so the per-worker pool
+can be sized against the database's connection limit.
+
+The pool itself is sized in config.py from DB_MAX_CONNECTIONS and the
+gunicorn worker count (WEB_CONCURRENCY).
+
+Pools are also made fork safe for gunicorn --preload: a connection opened
+in one process is never checked out in another, where it would share its
+socket with the parent.
+"""
+import os
+import time
+import bisect
+import threading
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool, QueuePool
+
+# Upper bounds (in milliseconds) of the checkout wait time histogram buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class WaitHistogram():
+    """ A thread safe histogram of connection checkout wait times """
+
+    def __init__(self, buckets=WAIT_BUCKETS_MS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Forgets every observation """
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum_ms = 0.0
+            self.timeouts = 0
+
+    def observe(self, wait_ms, timed_out=False):
+        """ Records one checkout """
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, wait_ms)] += 1
+            self.count += 1
+            self.sum_ms += wait_ms
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self):
+        """ Returns the histogram with cumulative buckets, as Prometheus does """
+        with self._lock:
+            buckets = {}
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+                total += count
+                buckets[str(bound)] = total
+            return {
+                "count": self.count,
+                "sum_ms": round(self.sum_ms, 3),
+                "timeouts": self.timeouts,
+                "buckets": buckets,
+            }
+
+
+wait_times = WaitHistogram()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """ A QueuePool that records how long every checkout waited """
+
+    def connect(self):
+        return self._timed_checkout(super().connect)
+
+    def unique_connection(self):
+        # what Engine.connect() checks out through
+        return self._timed_checkout(super().unique_connection)
+
+    @staticmethod
+    def _timed_checkout(checkout):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return checkout()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            wait_times.observe((time.perf_counter() - start) * 1000, timed_out)
+
+
+def _remember_pid(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+
+
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    """ Refuses a connection inherited from the process that forked this one """
+    pid = os.getpid()
+    if connection_record.info.get("pid", pid) != pid:
+        # drop it without closing it, the parent still owns the socket
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection record belongs to pid {}, attempting to check out in pid {}".format(
+                connection_record.info["pid"], pid
+            )
+        )
+
+
+def init_app(app):
+    """ Uses the instrumented pool when the app is configured with a QueuePool """
+    options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    if "pool_size" in options:
+        options.setdefault("poolclass", InstrumentedQueuePool)
+    if not event.contains(Pool, "connect", _remember_pid):
+        event.listen(Pool, "connect", _remember_pid)
+        event.listen(Pool, "checkout", _check_pid)
+
+
+def pool_stats(engine):
+    """ Returns live statistics of an engine's connection pool """
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,  # pylint: disable=protected-access
+            timeout=pool.timeout(),
+        )
+    stats["wait"] = wait_times.snapshot()
+    return stats
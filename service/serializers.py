@@ -0,0 +1,97 @@
+"""
+Fast Serializers
+
+Builds response payloads with precompiled attribute getters instead of
+walking each model's serialize() method, and encodes them with orjson
+when it is installed. The bytes are the same as jsonify() would send:
+
+    * the payloads have the same keys and values as serialize()
+    * keys are sorted and separators are compact, as JSON_SORT_KEYS and
+      jsonify() do
+    * the stdlib encoder (with the app's JSON settings) is used whenever
+      orjson would differ, i.e. for non-ASCII text, DEL characters, integers
+      beyond 64 bits and types orjson does not know, and whenever the
+      app pretty prints
+
+The getters read attributes, so ORM instances, read-only records and
+column projections (e.g. query.with_entities(...) rows) serialize the same
+way. None of the columns are floats, whose formatting differs between the
+two encoders.
+"""
+from operator import attrgetter
+from flask import current_app, json, jsonify
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder is the fallback
+    orjson = None
+
+from service.timing import measure
+
+WISHLIST_FIELDS = ("id", "name", "email", "shared_with1", "shared_with2", "shared_with3", "shared")
+# The columns of the wishlist table; the shared_with fields are read from its shares
+WISHLIST_COLUMNS = ("id", "name", "email", "shared")
+SHARE_FIELDS = ("wishlist_id", "position", "email")
+ITEM_FIELDS = ("id", "wishlist_id", "name", "sku", "description", "quantity")
+
+_wishlist_values = attrgetter(*WISHLIST_FIELDS)
+_item_values = attrgetter(*ITEM_FIELDS)
+
+
+def serialize_item(item):
+    """ Serializes an Item or an item row into a dictionary """
+    return dict(zip(ITEM_FIELDS, _item_values(item)))
+
+
+def serialize_items(items):
+    """ Serializes a sequence of Items or item rows """
+    return [dict(zip(ITEM_FIELDS, _item_values(item))) for item in items]
+
+
+def serialize_wishlist(wishlist, items):
+    """ Serializes a Wishlist or a wishlist record together with its items """
+    message = dict(zip(WISHLIST_FIELDS, _wishlist_values(wishlist)))
+    message["shared_with"] = wishlist.shared_with
+    message["items"] = serialize_items(items)
+    return message
+
+
+def serialize_wishlists(wishlists):
+    """ Serializes a sequence of Wishlists with their (eagerly loaded) items and shares """
+    return [serialize_wishlist(wishlist, wishlist.items) for wishlist in wishlists]
+
+
+######################################################################
+#  E N C O D I N G
+######################################################################
+def _orjson_options():
+    return orjson.OPT_SORT_KEYS if current_app.config["JSON_SORT_KEYS"] else 0
+
+
+def dumps(payload):
+    """ Encodes a payload into the bytes jsonify() would send, minus the newline """
+    if orjson is not None:
+        with measure("json"):
+            try:
+                body = orjson.dumps(payload, option=_orjson_options())
+            except TypeError:  # orjson.JSONEncodeError, e.g. a huge integer
+                body = None
+        if body is not None and (
+                not current_app.config["JSON_AS_ASCII"] or (body.isascii() and b"\x7f" not in body)):
+            return body
+    # the app's JSON encoder is timed on its own
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(payload, status_code, headers=None):
+    """ A faster make_response(jsonify(payload), status_code, headers) """
+    if current_app.config["JSONIFY_PRETTYPRINT_REGULAR"] or current_app.debug:
+        response = jsonify(payload)
+    else:
+        response = current_app.response_class(
+            dumps(payload) + b"\n", mimetype=current_app.config["JSONIFY_MIMETYPE"]
+        )
+    response.status_code = status_code
+    if headers:
+        response.headers.extend(headers)
+    return response
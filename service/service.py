@@ -6,44 +6,66 @@ Describe what your service does here
 
 import os
 import sys
+import base64
+import hashlib
+import binascii
 import logging
-from flask import Flask, jsonify, request, url_for, make_response, abort
+from flask import Blueprint, Response, current_app, jsonify, json, request, url_for, make_response, abort
+from flask import stream_with_context
 from flask_api import status  # HTTP Status Codes
-from werkzeug.exceptions import NotFound
+from werkzeug.exceptions import BadRequest, NotFound
 
 # For this example we'll use SQLAlchemy, a popular ORM that supports a
 # variety of backends including SQLite, MySQL, and PostgreSQL
 from flask_sqlalchemy import SQLAlchemy
-from service.models import Wishlist, Item, DataValidationError
+from service.models import db, Wishlist, Item, Rollup, DataValidationError
+from service.pool import pool_stats
+from service.timing import measure
+from service.serializers import serialize_items, serialize_wishlists, json_response
+from service.compression import send_static
+from service import metrics
+from service.cache import cache, wishlist_key, item_key
 
-# Import Flask application
-from . import app
+# The routes are registered on the app by create_app()
+api = Blueprint("api", __name__)
+
+# Media type of newline delimited JSON responses
+NDJSON = "application/x-ndjson"
+
+# Not defined in flask_api.status: a batch entry skipped because another failed
+HTTP_424_FAILED_DEPENDENCY = 424
+
+# Largest id a row can have; SQLite and BIGINT keys are 64-bit
+MAX_ID = 2 ** 63 - 1
+
+# Groupings of /totals, by the ?by= argument
+TOTALS = {"wishlist": Item.totals_by_wishlist, "email": Item.totals_by_email}
 
 ######################################################################
 # GET INDEX
 ######################################################################
-@app.route("/")
+@api.route("/")
 def index():
     """ Root URL response """
     # return  "Reminder: return some useful information in json format about the service here", status.HTTP_200_OK
-    return app.send_static_file('index.html')
+    return send_static('index.html')
 
 ######################################################################
 # ADD A NEW WISHLIST
 ######################################################################
-@app.route("/wishlists", methods=["POST"])
+@api.route("/wishlists", methods=["POST"])
 def create_wishlists():
     """
     Creates a wishlist
     This endpoint will create a wishlist based the data in the body that is posted
     """
-    app.logger.info("Request to create a wishlist")
+    current_app.logger.info("Request to create a wishlist")
     check_content_type("application/json")
     wishlist = Wishlist()
     wishlist.deserialize(request.get_json())
     wishlist.create()
     message = wishlist.serialize()
-    location_url = url_for("get_wishlists", wishlist_id=wishlist.id, _external=True)
+    location_url = url_for(".get_wishlists", wishlist_id=wishlist.id, _external=True)
     return make_response(
         jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
     )
@@ -51,43 +73,66 @@ def create_wishlists():
 ######################################################################
 # RETRIEVE A WISHLIST by ID
 ######################################################################
-@app.route("/wishlists/<wishlist_id>", methods=["GET"])
+@api.route("/wishlists/<wishlist_id>", methods=["GET"])
 def get_wishlists(wishlist_id):
     """
     Retrieve a single Wishlist
     This endpoint will return a Wishlist based on it's id
     """
-    app.logger.info("Request to retrieve a Wishlist with id: %s", wishlist_id)
-    wishlist = Wishlist.find(wishlist_id)
-    if not wishlist:
+    current_app.logger.info("Request to retrieve a Wishlist with id: %s", wishlist_id)
+    if parse_id(wishlist_id) is None:
         raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
-    return make_response(jsonify(wishlist.serialize()), status.HTTP_200_OK)
+    wishlist_id = int(wishlist_id)
+    key = wishlist_key(wishlist_id)
+    entry = cache.get(key)
+    if entry is None:
+        if request.if_none_match:
+            # answer a revalidation from the version alone, without the items
+            version = Wishlist.find_version(wishlist_id)
+            if version is None:
+                raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
+            etag = wishlist_etag(wishlist_id, version)
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+        wishlist = Wishlist.find(wishlist_id)
+        if not wishlist:
+            raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
+        with measure("serialize"):
+            entry = {"etag": wishlist_etag(wishlist_id, wishlist.version), "wishlist": wishlist.serialize()}
+        cache.set(key, entry)
+
+    if request.if_none_match.contains_weak(entry["etag"]):
+        return not_modified(entry["etag"])
+    response = json_response(entry["wishlist"], status.HTTP_200_OK)
+    response.set_etag(entry["etag"])
+    return response
 
 ######################################################################
 # DELETE A WISHLIST
 ######################################################################
-@app.route("/wishlists/<wishlist_id>", methods=["DELETE"])
+@api.route("/wishlists/<wishlist_id>", methods=["DELETE"])
 def delete_wishlists(wishlist_id):
     """
     Delete a Wishlist
     This endpoint will delete a Wishlist based the id specified in the path
     """
-    app.logger.info("Request to delete wishlist with id: %s", wishlist_id)
-    wishlist = Wishlist.find(wishlist_id)
-    if wishlist:
-        wishlist.delete()
+    current_app.logger.info("Request to delete wishlist with id: %s", wishlist_id)
+    wishlist_id = parse_id(wishlist_id)
+    if wishlist_id is not None:
+        item_ids = Wishlist.delete_by_id(wishlist_id)
+        cache.delete(wishlist_key(wishlist_id), *[item_key(item_id) for item_id in item_ids])
     return make_response("", status.HTTP_204_NO_CONTENT)
 
 ######################################################################
 # UPDATE AN EXISTING Wishlist
 ######################################################################
-@app.route("/wishlists/<int:wishlist_id>", methods=["PUT"])
+@api.route("/wishlists/<int:wishlist_id>", methods=["PUT"])
 def update_wishlists(wishlist_id):
     """
     Update a wishlist
     This endpoint will update a wishlist based the body that is posted
     """
-    app.logger.info("Request to update wishlist with id: %s", wishlist_id)
+    current_app.logger.info("Request to update wishlist with id: %s", wishlist_id)
     check_content_type("application/json")
     wishlist = Wishlist.find(wishlist_id)
     if not wishlist:
@@ -95,53 +140,108 @@ def update_wishlists(wishlist_id):
     wishlist.deserialize(request.get_json())
     wishlist.id = wishlist_id
     wishlist.save()
+    cache.delete(wishlist_key(wishlist_id))
     return make_response(jsonify(wishlist.serialize()), status.HTTP_200_OK)
 
 ######################################################################
-# LIST ALL Wishlists (or query by name / email)
+# UPDATE SOME FIELDS OF A Wishlist
+######################################################################
+@api.route("/wishlists/<int:wishlist_id>", methods=["PATCH"])
+def patch_wishlists(wishlist_id):
+    """
+    Update some fields of a wishlist
+    Only the fields in the body are written, with a single UPDATE, and the
+    updated fields of the wishlist are returned, without its items or shares
+    """
+    current_app.logger.info("Request to patch wishlist with id: %s", wishlist_id)
+    check_content_type("application/json")
+    wishlist = Wishlist.patch(wishlist_id, request.get_json())
+    if wishlist is None:
+        raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
+    cache.delete(wishlist_key(wishlist_id))
+    return json_response(wishlist.as_dict(), status.HTTP_200_OK)
+
+######################################################################
+# LIST ALL Wishlists (or query by name / email / recipient)
 ######################################################################
-@app.route("/wishlists", methods=["GET"])
+@api.route("/wishlists", methods=["GET"])
 def list_wishlists():
-    """ Returns all of the Whishlists """
-    app.logger.info("Request for wishlists")
+    """
+    Returns all of the Whishlists
+    Results can be paged with ?limit=N; the "next" Link header of each page
+    carries the opaque ?after= cursor for the following one.
+    With "Accept: application/x-ndjson" the results are streamed instead
+    """
+    current_app.logger.info("Request for wishlists")
     wishlists = []
     # e.g., /wishlists?email=rudi@isawesome.com
     email = request.args.get("email")
+    # e.g., /wishlists?shared_with=becca@isawesome.com
+    shared_with = request.args.get("shared_with")
     # e.g., /wishlists?name=rudi
     name = request.args.get("name")
+    # e.g., /wishlists?limit=50&after=NDI
+    limit = get_page_limit()
+    after = decode_cursor(request.args.get("after"))
     if name:
-        wishlists = Wishlist.find_by_name(name)
+        query = Wishlist.find_by_name(name)
     elif email:
-        wishlists = Wishlist.find_by_email(email)
+        query = Wishlist.find_by_email(email)
+    elif shared_with:
+        query = Wishlist.find_by_shared_with(shared_with)
     else:
-        wishlists = Wishlist.all()
+        query = Wishlist.with_items()
+
+    if wants_ndjson():
+        return stream_ndjson(Wishlist.iter_pages(query, after, limit, records=True))
+
+    # fetch one extra row to find out if there is a next page
+    wishlists = Wishlist.find_records(query, after, limit + 1 if limit else None)
+    headers = {}
+    if limit and len(wishlists) > limit:
+        wishlists = wishlists[:limit]
+        args = {"limit": limit, "after": encode_cursor(wishlists[-1].id)}
+        if name:
+            args["name"] = name
+        elif email:
+            args["email"] = email
+        elif shared_with:
+            args["shared_with"] = shared_with
+        next_url = url_for(".list_wishlists", _external=True, **args)
+        headers["Link"] = '<{}>; rel="next"'.format(next_url)
 
-    results = [wishlist.serialize() for wishlist in wishlists]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    with measure("serialize"):
+        results = serialize_wishlists(wishlists)
+    return json_response(results, status.HTTP_200_OK, headers)
 
 ######################################################################
 # SHARE A WISHTLIST
 ######################################################################
-@app.route("/wishlists/<int:wishlist_id>/shared", methods=["PUT"])
+@api.route("/wishlists/<int:wishlist_id>/shared", methods=["PUT"])
 def share_wishlist(wishlist_id):
     """
     Switch the "share" status of a wishlist from 0 to 1
+    The flag is flipped by a single UPDATE, so concurrent toggles never
+    get lost; the wishlist is then read back with its items and shares
     """
-    app.logger.info("Request to share wishlist with id: %s", wishlist_id)
+    current_app.logger.info("Request to share wishlist with id: %s", wishlist_id)
     check_content_type("application/json")
-    wishlist = Wishlist.find_or_404(wishlist_id)
-    wishlist.shared = not wishlist.shared
-    wishlist.save()
-    message = wishlist.serialize()
-    return make_response(jsonify(message), status.HTTP_200_OK)
+    if Wishlist.toggle_shared(wishlist_id) is None:
+        raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
+    cache.delete(wishlist_key(wishlist_id))
+    wishlist = Wishlist.find(wishlist_id)
+    if wishlist is None:  # deleted since the toggle
+        raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
+    return json_response(wishlist.serialize(), status.HTTP_200_OK)
 
 ######################################################################
 # DELETE ALL WISHLIST DATA (for testing only)
 ######################################################################
-@app.route('/wishlists/reset', methods=['DELETE'])
+@api.route('/wishlists/reset', methods=['DELETE'])
 def wishlists_reset():
     """ Removes all wishlists from the database """
     Wishlist.remove_all()
+    cache.clear()
     return make_response('', status.HTTP_204_NO_CONTENT)
 
 #---------------------------------------------------------------------
@@ -152,98 +252,428 @@ def wishlists_reset():
 # ADD AN ITEM TO WISHLIST
 ######################################################################
 
-@app.route('/wishlists/<int:wishlist_id>/items', methods=['POST'])
+@api.route('/wishlists/<int:wishlist_id>/items', methods=['POST'])
 def create_items(wishlist_id):
     """
     Create an item in a Wishlist
 
     This endpoint will add an item to a wishlist
     """
-    app.logger.info("Request to add an item to the wishlist")
+    current_app.logger.info("Request to add an item to the wishlist")
     check_content_type("application/json")
     wishlist = Wishlist.find_or_404(wishlist_id)
     item = Item()
     item.deserialize(request.get_json())
     wishlist.items.append(item)
     wishlist.save()
+    cache.delete(wishlist_key(wishlist_id))
     message = item.serialize()
     return make_response(jsonify(message), status.HTTP_201_CREATED)
 
+######################################################################
+# ADD A BATCH OF ITEMS TO WISHLIST
+######################################################################
+@api.route('/wishlists/<int:wishlist_id>/items/batch', methods=['POST'])
+def create_items_batch(wishlist_id):
+    """
+    Create many items in a Wishlist
+
+    This endpoint takes a JSON array of items and inserts every valid one
+    with a single statement and commit. The response has one result per
+    item in request order. With ?atomic=true nothing is inserted unless
+    every item is valid.
+    """
+    current_app.logger.info("Request to add a batch of items to the wishlist")
+    check_content_type("application/json")
+    data = request.get_json()
+    if not isinstance(data, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Body must be a JSON array of items")
+    if len(data) > current_app.config["BATCH_ITEMS_MAX"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            "A batch can hold at most {} items".format(current_app.config["BATCH_ITEMS_MAX"]),
+        )
+    atomic = request.args.get("atomic", "false").lower() in ("true", "1", "yes")
+    Wishlist.find_or_404(wishlist_id)
+
+    items = []
+    results = []
+    for index, item_data in enumerate(data):
+        if isinstance(item_data, dict):
+            item_data = dict(item_data, wishlist_id=wishlist_id)
+        try:
+            items.append(Item().deserialize(item_data))
+            results.append({"index": index, "status": status.HTTP_201_CREATED})
+        except DataValidationError as error:
+            results.append(
+                {"index": index, "status": status.HTTP_400_BAD_REQUEST, "error": str(error)}
+            )
+
+    if atomic and len(items) < len(data):
+        for result in results:
+            if result["status"] == status.HTTP_201_CREATED:
+                result["status"] = HTTP_424_FAILED_DEPENDENCY
+        return make_response(jsonify(results), status.HTTP_400_BAD_REQUEST)
+
+    Item.create_all(items)
+    cache.delete(wishlist_key(wishlist_id))
+    created = iter(items)
+    for result in results:
+        if result["status"] == status.HTTP_201_CREATED:
+            result["item"] = next(created).serialize()
+
+    if not items and data:
+        return make_response(jsonify(results), status.HTTP_400_BAD_REQUEST)
+    if len(items) < len(data):
+        return make_response(jsonify(results), status.HTTP_207_MULTI_STATUS)
+    return make_response(jsonify(results), status.HTTP_201_CREATED)
+
 ######################################################################
 # RETRIEVE AN ITEM FROM WISHLIST
 ######################################################################
-@app.route('/wishlists/<int:wishlist_id>/items/<int:item_id>', methods=['GET'])
+@api.route('/wishlists/<int:wishlist_id>/items/<int:item_id>', methods=['GET'])
 def get_items(wishlist_id, item_id):
     """
     Get an item
     This endpoint returns just an item
     """
-    app.logger.info("Request to get an item with id: %s", item_id)
-    item = Item.find_or_404(item_id)
-    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    current_app.logger.info("Request to get an item with id: %s", item_id)
+    message = cache.get_or_load(item_key(item_id), lambda: Item.find_or_404(item_id).serialize())
+    return json_response(message, status.HTTP_200_OK)
 
 ######################################################################
 # UPDATE AN ITEM
 ######################################################################
-@app.route("/wishlists/<int:wishlist_id>/items/<int:item_id>", methods=["PUT"])
+@api.route("/wishlists/<int:wishlist_id>/items/<int:item_id>", methods=["PUT"])
 def update_items(wishlist_id, item_id):
     """
     Update an Item
     This endpoint will update an item
     """
-    app.logger.info("Request to update item with id: %s", item_id)
+    current_app.logger.info("Request to update item with id: %s", item_id)
     check_content_type("application/json")
     item = Item.find_or_404(item_id)
+    old_wishlist_id = item.wishlist_id
     item.deserialize(request.get_json())
     item.id = item_id
-    
+    item.save()
+    cache.delete(item_key(item_id), wishlist_key(old_wishlist_id), wishlist_key(item.wishlist_id))
     return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
 
+######################################################################
+# UPDATE SOME FIELDS OF AN ITEM
+######################################################################
+@api.route("/wishlists/<int:wishlist_id>/items/<int:item_id>", methods=["PATCH"])
+def patch_items(wishlist_id, item_id):
+    """
+    Update some fields of an Item
+    Only the fields in the body are written, with a single UPDATE that
+    also bumps the version of the wishlist on PostgreSQL
+    """
+    current_app.logger.info("Request to patch item with id: %s", item_id)
+    check_content_type("application/json")
+    item = Item.patch(wishlist_id, item_id, request.get_json())
+    if item is None:
+        raise NotFound("Item with id '{}' was not found in Wishlist '{}'.".format(item_id, wishlist_id))
+    cache.delete(item_key(item_id), wishlist_key(wishlist_id))
+    return json_response(item.as_dict(), status.HTTP_200_OK)
+
 ######################################################################
 # DELETE AN ITEM
 ######################################################################
-@app.route("/wishlists/<int:wishlist_id>/items/<int:item_id>", methods=["DELETE"])
+@api.route("/wishlists/<int:wishlist_id>/items/<int:item_id>", methods=["DELETE"])
 def delete_item(wishlist_id, item_id):
     """
     Delete an Item
     This endpoint will delete an Item based the id specified in the path
     """
-    app.logger.info("Request to delete item with id: %s", item_id)
+    current_app.logger.info("Request to delete item with id: %s", item_id)
     item = Item.find(item_id)
     if item:
         item.delete()
+        cache.delete(item_key(item_id), wishlist_key(item.wishlist_id))
     return make_response("", status.HTTP_204_NO_CONTENT)
 
 ######################################################################
 # LIST ITEMS OR QUERY BY NAME
 ######################################################################
-@app.route("/wishlists/<int:wishlist_id>/items", methods=["GET"])
+@api.route("/wishlists/<int:wishlist_id>/items", methods=["GET"])
 def list_items(wishlist_id):
-    """ Returns all of the items in a wishlist """
-    app.logger.info("Request for wishlist items...")
-    wishlist = Wishlist.find_or_404(wishlist_id)
-    results = []
-    name=request.args.get("name")
-    if name:
-        for item in wishlist.items:
-            if item.name == name:
-                results.append(item.serialize())
-    else: results = [item.serialize() for item in wishlist.items]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    """
+    Returns all of the items in a wishlist
+    The items can be filtered with ?name= (and ?match=exact|icase|prefix),
+    ?sku= and capped with ?limit=.
+    With "Accept: application/x-ndjson" the items are streamed instead
+    """
+    current_app.logger.info("Request for wishlist items...")
+    version = Wishlist.find_version(wishlist_id)
+    if version is None:
+        raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
+    # each filter and media type is its own representation with its own tag
+    etag = wishlist_etag(
+        wishlist_id, version, "items?{}#{}".format(request.query_string.decode(), wants_ndjson())
+    )
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    # e.g., /wishlists/1/items?name=mug&match=icase
+    name = request.args.get("name")
+    match = request.args.get("match", "exact")
+    if match not in Item.NAME_MATCHES:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            "match must be one of {}".format(", ".join(Item.NAME_MATCHES)),
+        )
+    # e.g., /wishlists/1/items?sku=12345
+    sku = request.args.get("sku")
+    limit = get_page_limit()
+    query = Item.find_by_wishlist(wishlist_id, name=name, match=match, sku=sku)
+    if wants_ndjson():
+        response = stream_ndjson(Item.iter_pages(query, limit=limit, records=True))
+    else:
+        items = Item.find_records(query, limit=limit)
+        with measure("serialize"):
+            results = serialize_items(items)
+        response = json_response(results, status.HTTP_200_OK)
+    response.set_etag(etag)
+    return response
+
+######################################################################
+# ITEM TOTALS PER WISHLIST OR EMAIL
+######################################################################
+@api.route("/totals", methods=["GET"])
+def list_totals():
+    """
+    Returns the item count and total quantity of every wishlist
+    With ?by=email they are totaled per owner email instead, and ?email=
+    only totals the wishlists of one email. The totals are computed by
+    the database with COUNT, SUM and GROUP BY.
+    """
+    current_app.logger.info("Request for item totals")
+    by = request.args.get("by", "wishlist")
+    if by not in TOTALS:
+        abort(status.HTTP_400_BAD_REQUEST, "by must be one of {}".format(", ".join(TOTALS)))
+    rows = TOTALS[by](request.args.get("email"))
+    return json_response([row._asdict() for row in rows], status.HTTP_200_OK)
+
+######################################################################
+# FULL-TEXT SEARCH OF ITEMS
+######################################################################
+@api.route("/search", methods=["GET"])
+def search_items():
+    """
+    Returns the items whose name or description contain the words of ?q=,
+    best match first
+    Only shared wishlists are searched, unless ?wishlist_id= or ?email=
+    picks one wishlist or the wishlists of one owner. Pages hold ?limit=
+    items (SEARCH_PAGE_SIZE by default); the "next" Link header carries
+    the opaque ?after= cursor for the following one.
+    """
+    current_app.logger.info("Request for item search")
+    # e.g., /search?q=ceramic+mug&email=rudi@isawesome.com
+    text = request.args.get("q", "")
+    email = request.args.get("email") or None
+    wishlist_id = request.args.get("wishlist_id")
+    if wishlist_id is not None:
+        wishlist_id = parse_id(wishlist_id)
+        if wishlist_id is None:
+            abort(status.HTTP_400_BAD_REQUEST, "wishlist_id must be an integer")
+    limit = get_page_limit() or current_app.config["SEARCH_PAGE_SIZE"]
+    after = decode_search_cursor(request.args.get("after"))
+    # fetch one extra match to find out if there is a next page
+    matches = Item.search(text, wishlist_id, email, after, limit + 1)
+    headers = {}
+    if len(matches) > limit:
+        matches = matches[:limit]
+        record, rank = matches[-1]
+        args = {"q": text, "limit": limit, "after": encode_search_cursor(rank, record.id)}
+        if wishlist_id is not None:
+            args["wishlist_id"] = wishlist_id
+        elif email:
+            args["email"] = email
+        next_url = url_for(".search_items", _external=True, **args)
+        headers["Link"] = '<{}>; rel="next"'.format(next_url)
+
+    with measure("serialize"):
+        results = serialize_items(record for record, _ in matches)
+    return json_response(results, status.HTTP_200_OK, headers)
+
+######################################################################
+# WISHLIST AND ITEM STATISTICS
+######################################################################
+@api.route("/stats", methods=["GET"])
+def get_stats():
+    """
+    Returns the number of wishlists and items, and the emails, wishlists
+    and SKUs with the most of them (?limit=, 10 by default)
+    The counts are read from the rollup table, which every write keeps
+    up to date, so no wishlist or item is scanned.
+    """
+    current_app.logger.info("Request for statistics")
+    limit = get_page_limit() or 10
+    stats = {
+        "wishlists": Rollup.total("wishlists"),
+        "items": Rollup.total("items"),
+        "top_emails": [
+            {"email": name, "wishlists": count} for name, count in Rollup.top(Rollup.EMAIL, limit)
+        ],
+        "top_wishlists": [
+            {"wishlist_id": int(name), "items": count} for name, count in Rollup.top(Rollup.WISHLIST, limit)
+        ],
+        "top_skus": [
+            {"sku": name, "items": count} for name, count in Rollup.top(Rollup.SKU, limit)
+        ],
+    }
+    return json_response(stats, status.HTTP_200_OK)
+
+######################################################################
+# CACHE STATISTICS
+######################################################################
+@api.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """ Returns the hit and miss counters of the read-through cache """
+    return make_response(jsonify(cache.stats()), status.HTTP_200_OK)
+
+######################################################################
+# CONNECTION POOL STATISTICS
+######################################################################
+@api.route("/pool/stats", methods=["GET"])
+def connection_pool_stats():
+    """ Returns live statistics of this worker's database connection pool """
+    return make_response(jsonify(pool_stats(db.engine)), status.HTTP_200_OK)
+
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@api.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """ Returns the request, database and pool metrics of every worker """
+    body, content_type = metrics.latest()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
+
+######################################################################
+#  E R R O R   H A N D L E R S
+######################################################################
+@api.errorhandler(DataValidationError)
+def request_validation_error(error):
+    """ Answers a body that does not deserialize with 400 Bad Request """
+    current_app.logger.warning(str(error))
+    return BadRequest(str(error))
+
+@api.url_value_preprocessor
+def check_ids(endpoint, values):
+    """ Answers 404 for <int:> ids no row can have, before they overflow a query """
+    for name, value in (values or {}).items():
+        if isinstance(value, int) and value > MAX_ID:
+            raise NotFound("{} '{}' was not found.".format(name, value))
 
 
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
-def init_db():
+def init_db(app):
     """ Initialies the SQLAlchemy app """
-    global app
     Wishlist.init_db(app)
 
+def parse_id(value):
+    """ Returns an id given as text, or None if no row can have it """
+    # isdigit() would also pass digits such as "²", which int() rejects
+    if not value.isdecimal():
+        return None
+    row_id = int(value)
+    return row_id if row_id <= MAX_ID else None
+
+def wishlist_etag(wishlist_id, version, variant=""):
+    """
+    Returns the strong ETag of a representation of a Wishlist
+
+    The version changes with every write to the Wishlist or its items, and
+    the variant tells apart different representations of the same version
+    """
+    tag = "{}.{}".format(wishlist_id, version)
+    if variant:
+        tag += "." + hashlib.sha1(variant.encode("utf-8")).hexdigest()[:16]
+    return tag
+
+def not_modified(etag):
+    """ Returns an empty 304 Not Modified response carrying the ETag """
+    response = make_response("", status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+def wants_ndjson():
+    """ Checks if the client prefers newline delimited JSON over a JSON array """
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON])
+    return best == NDJSON
+
+def stream_ndjson(pages):
+    """
+    Streams records as newline delimited JSON, one serialized record per line
+
+    Each page is serialized and sent as soon as it is read, so the first
+    bytes go out before the whole result has been queried and only one
+    page of records is held in memory at a time
+    """
+    def generate():
+        for page in pages:
+            yield "".join(json.dumps(record.serialize()) + "\n" for record in page)
+    return Response(stream_with_context(generate()), status.HTTP_200_OK, mimetype=NDJSON)
+
+def get_page_limit():
+    """ Returns the ?limit= page size or None when the client wants everything """
+    limit = request.args.get("limit")
+    if limit is None:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "limit must be an integer")
+    if limit < 1 or limit > current_app.config["PAGE_LIMIT_MAX"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            "limit must be between 1 and {}".format(current_app.config["PAGE_LIMIT_MAX"]),
+        )
+    return limit
+
+def encode_cursor(last_id):
+    """ Encodes the id of the last row on a page as an opaque cursor """
+    return base64.urlsafe_b64encode(str(last_id).encode("ascii")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """ Decodes a cursor made by encode_cursor back into an id """
+    if cursor is None:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        last_id = parse_id(base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii"))
+    except (ValueError, UnicodeError, binascii.Error):
+        last_id = None
+    if last_id is None:
+        abort(status.HTTP_400_BAD_REQUEST, "after is not a valid cursor")
+    return last_id
+
+def encode_search_cursor(rank, last_id):
+    """ Encodes the rank and id of the last match on a page as an opaque cursor """
+    return encode_cursor("{!r},{}".format(rank, last_id))
+
+def decode_search_cursor(cursor):
+    """ Decodes a cursor made by encode_search_cursor back into a (rank, id) pair """
+    if cursor is None:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, last_id = base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii").split(",")
+        rank, last_id = float(rank), parse_id(last_id)
+    except (ValueError, UnicodeError, binascii.Error):
+        last_id = None
+    if last_id is None:
+        abort(status.HTTP_400_BAD_REQUEST, "after is not a valid cursor")
+    return rank, last_id
+
 def check_content_type(content_type):
     """ Checks that the media type is correct """
     if request.headers["Content-Type"] == content_type:
         return
-    app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
+    current_app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
     abort(415, "Content-Type must be {}".format(content_type))
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+Request Timing
+
+Breaks the time of every request down into database time (measured with
+SQLAlchemy engine events), the number of queries, serialization time, JSON
+encoding time and the total, and sends it back in a Server-Timing header:
+
+    Server-Timing: db;dur=1.93;desc="3 queries", serialize;dur=0.41,
+                   json;dur=0.12, total;dur=3.88
+
+With SERVER_TIMING_LOG the same numbers are also logged as one JSON line.
+When SERVER_TIMING is off no hooks or listeners are installed at all, and
+measure() returns right away.
+"""
+import json
+import time
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Set by init_app() when SERVER_TIMING is on
+ENABLED = False
+_log_requests = False
+_logger = None
+
+
+class RequestTiming():
+    """ The timings collected for one request """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.durations = {}
+
+    def add(self, name, seconds):
+        """ Adds time to the named metric """
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def milliseconds(self, name):
+        return round(self.durations.get(name, 0.0) * 1000, 3)
+
+    def header(self, total_ms):
+        """ Formats the Server-Timing header value """
+        metrics = ['db;dur={};desc="{} queries"'.format(self.milliseconds("db"), self.queries)]
+        for name in ("serialize", "json"):
+            if name in self.durations:
+                metrics.append("{};dur={}".format(name, self.milliseconds(name)))
+        metrics.append("total;dur={}".format(total_ms))
+        return ", ".join(metrics)
+
+
+def current_timing():
+    """ Returns the timing of the request being handled, if any """
+    if not ENABLED or not has_request_context():
+        return None
+    return g.get("timing")
+
+
+@contextmanager
+def measure(name):
+    """ Adds the time spent in the block to a Server-Timing metric """
+    timing = current_timing()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+
+
+######################################################################
+#  H O O K S
+######################################################################
+def _start_request():
+    g.timing = RequestTiming()
+
+
+def _finish_request(response):
+    timing = g.pop("timing", None)
+    if timing is None:
+        return response
+    total_ms = round((time.perf_counter() - timing.start) * 1000, 3)
+    response.headers["Server-Timing"] = timing.header(total_ms)
+    if _log_requests:
+        _logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": total_ms,
+            "db_ms": timing.milliseconds("db"),
+            "queries": timing.queries,
+            "serialize_ms": timing.milliseconds("serialize"),
+            "json_ms": timing.milliseconds("json"),
+        }))
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # one value, not a stack: a failed statement never reaches
+    # after_cursor_execute, and the next statement just overwrites it
+    conn.info["query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("query_start", None)
+    timing = current_timing()
+    if timing is not None and start is not None:
+        timing.queries += 1
+        timing.add("db", time.perf_counter() - start)
+
+
+def _timed_encoder(encoder):
+    """ Returns a subclass of the app's JSON encoder that times encode() """
+    class TimedJSONEncoder(encoder):
+        def encode(self, o):
+            with measure("json"):
+                return super().encode(o)
+    return TimedJSONEncoder
+
+
+def init_app(app):
+    """ Installs the timing hooks when SERVER_TIMING is on """
+    global ENABLED, _logger, _log_requests
+    if not app.config.get("SERVER_TIMING", False):
+        return
+    _logger = app.logger
+    _log_requests = app.config.get("SERVER_TIMING_LOG", False)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.json_encoder = _timed_encoder(app.json_encoder)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    ENABLED = True
@@ -44,7 +44,7 @@ class ItemFactory(factory.Factory):
     name = FuzzyChoice(choices=["Chocolate", "Umbrella", "Hairbrush", "Nailpolish", "Mug", "Notebook", "Carpet"])
     sku = FuzzyChoice(choices=["12345", "678910", "111213", "141516"])
     description = FuzzyChoice(choices=["darkcholocate", "pouringrain", "narsred", "ceramic", "100pages", "fur", "sturdywood"])
-    quantity = FuzzyChoice(choices=["2", "12", "14", "15", "45", "100", "5000"])
+    quantity = FuzzyChoice(choices=[2, 12, 14, 15, 45, 100, 5000])
 
 if __name__ == "__main__":
     for _ in range(10):
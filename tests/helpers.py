@@ -0,0 +1,34 @@
+"""
+Helpers shared by the test suites
+"""
+from sqlalchemy import event
+from service.models import db
+
+
+class QueryCounter():
+    """
+    Counts the SQL statements sent to the database while it is active
+
+    Usage:
+        with QueryCounter() as queries:
+            resp = self.app.get("/wishlists")
+        self.assertEqual(queries.count, 2)
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(db.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(db.engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        """ Number of statements executed so far """
+        return len(self.statements)
@@ -0,0 +1,33 @@
+"""
+Test cases for the application factory
+
+"""
+import unittest
+import config
+from service import create_app
+
+
+class UnreachableDatabaseConfig():
+    """ The configuration with a database nobody listens to """
+    SQLALCHEMY_DATABASE_URI = "postgres://nobody@127.0.0.1:9/wishlists"
+
+
+for _name in dir(config):
+    if _name.isupper() and not hasattr(UnreachableDatabaseConfig, _name):
+        setattr(UnreachableDatabaseConfig, _name, getattr(config, _name))
+
+
+######################################################################
+#  A P P L I C A T I O N   F A C T O R Y   T E S T   C A S E S
+######################################################################
+class TestCreateApp(unittest.TestCase):
+    """ Test Cases for create_app """
+
+    def test_no_database_at_startup(self):
+        """ Create the app without connecting to the database """
+        app = create_app(UnreachableDatabaseConfig)
+        self.assertEqual(app.config["SQLALCHEMY_DATABASE_URI"], UnreachableDatabaseConfig.SQLALCHEMY_DATABASE_URI)
+        resp = app.test_client().get("/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("list_wishlists", [rule.endpoint.split(".")[-1] for rule in app.url_map.iter_rules()])
+        self.assertIn("db-create", app.cli.commands)
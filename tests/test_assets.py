@@ -0,0 +1,85 @@
+"""
+Test cases for the fingerprinted static assets
+
+"""
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+from service import app
+from service.assets import AssetTable, fingerprint, IMMUTABLE
+
+
+######################################################################
+#  A S S E T   T E S T   C A S E S
+######################################################################
+class TestAssets(unittest.TestCase):
+    """ Test Cases for the in-memory asset table """
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.table = app.extensions["assets"]
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, data):
+        path = os.path.join(self.folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as target:
+            target.write(data)
+
+    def test_fingerprint(self):
+        """ Put the content hash into the file name """
+        first = fingerprint("css/site.min.css", b"a")
+        self.assertRegex(first, r"^css/site\.min\.[0-9a-f]{12}\.css$")
+        self.assertNotEqual(first, fingerprint("css/site.min.css", b"b"))
+
+    def test_rewrite_index(self):
+        """ Point index.html at the fingerprinted URLs """
+        self.write("js/app.js", b"alert(1);")
+        self.write("index.html", b'<script src = "static/js/app.js"></script><a href="static/none.css">')
+        self.write("js/app.js.gz", gzip.compress(b"alert(1);"))
+        table = AssetTable(self.folder, index_max_age=5)
+        url = table.url("js/app.js")
+        html = table.assets["/"].data.decode()
+        self.assertIn('src = "{}"'.format(url), html)
+        self.assertIn('href="static/none.css"', html)
+        self.assertEqual(table.assets["/"].cache_control, "public, max-age=5")
+        self.assertEqual(gzip.decompress(table.assets["/" + url].variants["gzip"]), b"alert(1);")
+        self.assertEqual(len(table.assets), 2)
+
+    def test_serve_fingerprinted(self):
+        """ Serve a fingerprinted file from memory with an immutable Cache-Control """
+        url = "/" + self.table.url("js/rest_api.js")
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["Cache-Control"], IMMUTABLE)
+        with open(os.path.join(app.static_folder, "js", "rest_api.js"), "rb") as source:
+            self.assertEqual(resp.get_data(), source.read())
+        resp = self.app.get(url, headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, 304)
+        resp = self.app.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertTrue(resp.headers["ETag"].endswith('-gzip"'))
+        resp = self.app.head(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_data(), b"")
+
+    def test_serve_index(self):
+        """ Serve the rewritten index.html with a short Cache-Control """
+        resp = self.app.get("/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["Cache-Control"], "public, max-age=60")
+        self.assertIn(self.table.url("css/blue_bootstrap.min.css"), resp.get_data(as_text=True))
+
+    def test_fall_through(self):
+        """ Leave unknown paths and plain static URLs to Flask """
+        resp = self.app.get("/static/js/rest_api.js")
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("immutable", resp.headers.get("Cache-Control", ""))
+        resp.close()
+        resp = self.app.get("/static/js/rest_api.000000000000.js")
+        self.assertEqual(resp.status_code, 404)
@@ -0,0 +1,80 @@
+"""
+Test cases for the read-through cache
+
+"""
+import unittest
+from unittest.mock import Mock, patch
+from werkzeug.exceptions import NotFound
+from service.cache import Cache, CacheError, LRUBackend
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUBackend(unittest.TestCase):
+    """ Test Cases for the in-process LRU backend """
+
+    def test_evicts_least_recently_used(self):
+        """ Evict the least recently used entry when full """
+        backend = LRUBackend(max_entries=2, ttl=60)
+        backend.set("a", 1)
+        backend.set("b", 2)
+        self.assertEqual(backend.get("a"), 1)
+        backend.set("c", 3)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), 1)
+        self.assertEqual(backend.get("c"), 3)
+        self.assertEqual(len(backend), 2)
+
+    def test_expires_entries(self):
+        """ Drop entries older than the TTL """
+        backend = LRUBackend(max_entries=2, ttl=10)
+        with patch("service.cache.time.monotonic", return_value=100):
+            backend.set("a", 1)
+        with patch("service.cache.time.monotonic", return_value=105):
+            self.assertEqual(backend.get("a"), 1)
+        with patch("service.cache.time.monotonic", return_value=111):
+            self.assertIsNone(backend.get("a"))
+        self.assertEqual(len(backend), 0)
+
+
+class TestCache(unittest.TestCase):
+    """ Test Cases for the read-through Cache """
+
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.init_app(Mock(config={"CACHE_TYPE": "lru"}))
+
+    def test_read_through(self):
+        """ Load a value once and count hits and misses """
+        loader = Mock(return_value={"id": 1})
+        self.assertEqual(self.cache.get_or_load("wishlist:1", loader), {"id": 1})
+        self.assertEqual(self.cache.get_or_load("wishlist:1", loader), {"id": 1})
+        loader.assert_called_once_with()
+        self.assertEqual(self.cache.stats(), {"backend": "lru", "entries": 1, "hits": 1, "misses": 1})
+
+        self.cache.delete("wishlist:1")
+        self.cache.get_or_load("wishlist:1", loader)
+        self.assertEqual(loader.call_count, 2)
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_loader_errors_not_cached(self):
+        """ Do not cache a lookup that raised """
+        loader = Mock(side_effect=NotFound())
+        self.assertRaises(NotFound, self.cache.get_or_load, "item:1", loader)
+        self.assertRaises(NotFound, self.cache.get_or_load, "item:1", loader)
+        self.assertEqual(loader.call_count, 2)
+
+    def test_bad_cache_type(self):
+        """ Reject an unknown CACHE_TYPE """
+        app = Mock(config={"CACHE_TYPE": "memcached"})
+        self.assertRaises(CacheError, self.cache.init_app, app)
+
+    def test_no_cache(self):
+        """ Always load with CACHE_TYPE=none """
+        self.cache.init_app(Mock(config={"CACHE_TYPE": "none"}))
+        loader = Mock(return_value=1)
+        self.cache.get_or_load("item:1", loader)
+        self.cache.get_or_load("item:1", loader)
+        self.assertEqual(loader.call_count, 2)
@@ -0,0 +1,80 @@
+"""
+Test cases for response compression
+
+"""
+import os
+import gzip
+import unittest
+import mimetypes
+from service import app, compression
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(unittest.TestCase):
+    """ Test Cases for negotiated and precompressed responses """
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.written = []
+
+    def tearDown(self):
+        for path in self.written:
+            os.remove(path)
+
+    def test_gzip_large_response(self):
+        """ Compress a response above the size threshold with gzip """
+        plain = self.app.get("/metrics")
+        self.assertGreaterEqual(len(plain.get_data()), app.config["COMPRESS_MIN_SIZE"])
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(plain.headers["Vary"], "Accept-Encoding")
+        resp = self.app.get("/metrics", headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(int(resp.headers["Content-Length"]), len(resp.get_data()))
+        self.assertIn(b"wishlists_http_requests_total", gzip.decompress(resp.get_data()))
+
+    @unittest.skipIf(compression.brotli is None, "brotli is not installed")
+    def test_brotli_preferred(self):
+        """ Compress with brotli when the client accepts it """
+        resp = self.app.get("/metrics", headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertIn(b"wishlists_http_requests_total", compression.brotli.decompress(resp.get_data()))
+        resp = self.app.get("/metrics", headers={"Accept-Encoding": "gzip, br;q=0.5"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+
+    def test_small_response(self):
+        """ Leave a response below the size threshold alone """
+        resp = self.app.get("/cache/stats", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertIsNotNone(resp.get_json())
+
+    def test_precompressed_static(self):
+        """ Serve the precompressed variant of a static file """
+        runner = app.test_cli_runner(mix_stderr=False)
+        result = runner.invoke(args=["precompress-static"])
+        self.assertEqual(result.exit_code, 0, result.stderr)
+        for root, _, files in os.walk(app.static_folder):
+            self.written += [os.path.join(root, name) for name in files if name.endswith((".gz", ".br"))]
+        self.assertIn(os.path.join(app.static_folder, "js", "rest_api.js.gz"), self.written)
+
+        resp = self.app.get("/static/js/rest_api.js", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.mimetype, mimetypes.guess_type("rest_api.js")[0])
+        resp.direct_passthrough = False
+        with open(os.path.join(app.static_folder, "js", "rest_api.js"), "rb") as source:
+            self.assertEqual(gzip.decompress(resp.get_data()), source.read())
+        resp.close()
+
+        resp = self.app.get("/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        resp.close()
+        resp = self.app.get("/static/js/rest_api.js")
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.headers["Vary"], "Accept-Encoding")
+        resp.close()
+
+    def test_compress_is_reproducible(self):
+        """ Compress the same bytes the same way every time """
+        data = b"wishlist " * 200
+        self.assertEqual(compression.compress(data, "gzip", 6), compression.compress(data, "gzip", 6))
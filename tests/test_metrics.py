@@ -0,0 +1,32 @@
+"""
+Test cases for the Prometheus metrics
+
+"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from service import metrics
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMetrics(unittest.TestCase):
+    """ Test Cases for the metrics registry """
+
+    def test_single_process_registry(self):
+        """ Collect from the default registry without a multiprocess directory """
+        with patch.dict(os.environ, clear=True):
+            self.assertIs(metrics.registry(), REGISTRY)
+
+    def test_multiprocess_registry(self):
+        """ Merge the files of every worker with a multiprocess directory """
+        with tempfile.TemporaryDirectory() as path:
+            with patch.dict(os.environ, {metrics.MULTIPROC_DIR_ENV: path}):
+                registry = metrics.registry()
+                self.assertIsNot(registry, REGISTRY)
+                body, content_type = metrics.latest()
+        self.assertTrue(content_type.startswith("text/plain"))
+        self.assertEqual(body, b"")
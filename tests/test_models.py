@@ -5,7 +5,12 @@ Test cases for Wishlist Model
 import logging
 import unittest
 import os
-from service.models import Wishlist, Item, DataValidationError, db
+from collections import Counter
+from unittest.mock import patch
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError, OperationalError
+from service.models import Wishlist, Item, Share, Rollup, DataValidationError, SQLITE_SEARCH_TRIGGERS, db
+from service import migrations
 from service import app
 from tests.factories import WishlistFactory
 from tests.factories import ItemFactory
@@ -201,6 +206,65 @@ class TestWishlist(unittest.TestCase):
         self.assertEqual(wishlists[0].shared_with2, "Thomas Chao")
         self.assertEqual(wishlists[0].shared_with3, "Isaias Martin")
     
+    def test_find_page(self):
+        """ Find a page of Wishlists after a given id """
+        for _ in range(5):
+            _create_wishlist().create()
+        wishlists = Wishlist.find_page(limit=2)
+        self.assertEqual([w.id for w in wishlists], [1, 2])
+        wishlists = Wishlist.find_page(after=2, limit=2)
+        self.assertEqual([w.id for w in wishlists], [3, 4])
+        wishlists = Wishlist.find_page(after=4)
+        self.assertEqual([w.id for w in wishlists], [5])
+
+    def test_iter_pages(self):
+        """ Iterate over all Wishlists one page at a time """
+        for _ in range(5):
+            _create_wishlist().create()
+        with patch.object(Wishlist, "PAGE_SIZE", 2):
+            pages = list(Wishlist.iter_pages())
+            self.assertEqual([[w.id for w in page] for page in pages], [[1, 2], [3, 4], [5]])
+            pages = list(Wishlist.iter_pages(after=1, limit=3))
+            self.assertEqual([[w.id for w in page] for page in pages], [[2, 3], [4]])
+
+    def test_find_records(self):
+        """ Find a page of read-only Wishlist records with their items """
+        wishlist = _create_wishlist(items=[_create_item(), _create_item()])
+        wishlist.create()
+        other = _create_wishlist()
+        other.name = wishlist.name + " too"
+        other.create()
+        expected = [w.serialize() for w in Wishlist.all()]
+        db.session.expunge_all()
+        records = Wishlist.find_records(limit=2)
+        self.assertEqual([r.serialize() for r in records], expected)
+        self.assertEqual(len(db.session.identity_map), 0)
+        self.assertFalse(hasattr(records[0], "__dict__"))
+        records = Wishlist.find_records(Wishlist.find_by_name(wishlist.name), after=0)
+        self.assertEqual([r.id for r in records], [wishlist.id])
+        self.assertEqual([i.id for i in records[0].items], [i.id for i in wishlist.items])
+
+    def test_iter_records(self):
+        """ Iterate over read-only Item records one page at a time """
+        wishlist = _create_wishlist(items=[_create_item() for _ in range(3)])
+        wishlist.create()
+        with patch.object(Item, "PAGE_SIZE", 2):
+            pages = list(Item.iter_pages(Item.find_by_wishlist(wishlist.id), records=True))
+        self.assertEqual([[i.id for i in page] for page in pages], [[1, 2], [3]])
+        self.assertEqual(pages[1][0].serialize(), Item.find(3).serialize())
+
+    def test_lookup_indexes(self):
+        """ Lookup columns are indexed """
+        wishlist_indexes = {tuple(c.name for c in i.columns) for i in Wishlist.__table__.indexes}
+        self.assertIn(("name",), wishlist_indexes)
+        self.assertIn(("email",), wishlist_indexes)
+        item_indexes = {tuple(c.name for c in i.columns) for i in Item.__table__.indexes}
+        self.assertIn(("sku",), item_indexes)
+        self.assertIn(("wishlist_id", "name"), item_indexes)
+        share_indexes = {tuple(c.name for c in i.columns) for i in Share.__table__.indexes}
+        self.assertIn(("email",), share_indexes)
+        self.assertIn(("wishlist_id", "position"), share_indexes)
+
     def test_find_by_email(self):
         """ Find Wishlists by email """
         Wishlist(
@@ -223,6 +287,192 @@ class TestWishlist(unittest.TestCase):
         self.assertEqual(wishlists[0].shared_with2, "Thomas Chao")
         self.assertEqual(wishlists[0].shared_with3, "Isaias Martin")
 
+    def test_share_with_many(self):
+        """ Share a Wishlist with any number of recipients """
+        emails = ["{}@stern.nyu.edu".format(n) for n in range(5)]
+        wishlist = Wishlist(name="Rudi's Wishlist", email="rudi@stern.nyu.edu", shared_with=emails)
+        wishlist.create()
+        wishlist_id = wishlist.id
+        db.session.expunge_all()
+        wishlist = Wishlist.find(wishlist_id)
+        self.assertEqual(wishlist.shared_with, emails)
+        self.assertEqual(wishlist.shared_with1, emails[0])
+        self.assertEqual(wishlist.shared_with3, emails[2])
+        self.assertEqual(wishlist.serialize()["shared_with"], emails)
+
+        wishlist.shared_with2 = None
+        wishlist.shared_with = ["new@stern.nyu.edu"]
+        wishlist.save()
+        self.assertEqual(Share.query.count(), 1)
+        self.assertIsNone(Wishlist.find(wishlist.id).shared_with2)
+        wishlist.delete()
+        self.assertEqual(Share.query.count(), 0)
+
+    def test_deserialize_shared_with(self):
+        """ Deserialize the shared_with list or the legacy fields """
+        data = {"name": "home", "email": "a@b.c", "shared_with": ["x", "y", "z", "w"], "shared_with1": "old"}
+        wishlist = Wishlist().deserialize(data)
+        self.assertEqual(wishlist.shared_with, ["x", "y", "z", "w"])
+        wishlist.deserialize({"name": "home", "email": "a@b.c", "shared_with1": "v", "shared_with3": ""})
+        self.assertEqual(wishlist.shared_with, ["v", "y", "w"])
+        self.assertIsNone(wishlist.shared_with3)
+        data["shared_with"] = "x"
+        self.assertRaises(DataValidationError, wishlist.deserialize, data)
+        for recipients in ([{"x": 1}], [1], ["x", ["y"]]):
+            data["shared_with"] = recipients
+            self.assertRaises(DataValidationError, wishlist.deserialize, data)
+        self.assertRaises(
+            DataValidationError, wishlist.deserialize, {"name": "home", "email": "a@b.c", "shared_with2": 2}
+        )
+
+    def test_unique_share_positions(self):
+        """ Hold one recipient per position of a Wishlist """
+        wishlist = Wishlist(name="home", email="a@b.c", shared_with=["x"])
+        wishlist.create()
+        db.session.add(Share(wishlist_id=wishlist.id, position=1, email="y"))
+        self.assertRaises(IntegrityError, db.session.commit)
+        db.session.rollback()
+        self.assertEqual(Wishlist.find(wishlist.id).shared_with, ["x"])
+
+    def test_migrate_share_positions(self):
+        """ Make the share positions of an older database unique """
+        wishlist = Wishlist(name="home", email="a@b.c")
+        wishlist.create()
+        wishlist_id = wishlist.id
+        db.session.remove()
+        db.session.execute("DROP INDEX ix_share_wishlist_id_position")
+        db.session.execute("CREATE INDEX ix_share_wishlist_id_position ON share (wishlist_id, position)")
+        db.session.execute(
+            "INSERT INTO share (wishlist_id, position, email) VALUES "
+            "(:id, 1, 'x'), (:id, 1, 'y'), (:id, 2, 'z')", {"id": wishlist_id}
+        )
+        db.session.commit()
+        self.assertEqual(migrations.upgrade(), ["unique_share_positions"])
+        self.assertEqual(migrations.upgrade(), [])
+        self.assertEqual(Wishlist.find(wishlist_id).shared_with, ["y", "z"])
+
+    def test_find_by_shared_with(self):
+        """ Find Wishlists by a recipient """
+        Wishlist(name="Rudi's Wishlist", email="rudi@stern.nyu.edu", shared_with=["becca", "thomas"]).create()
+        Wishlist(name="Bea's Wishlist", email="bea@stern.nyu.edu", shared_with=["thomas", "isaias", "becca"]).create()
+        Wishlist(name="John's Wishlist", email="john@stern.nyu.edu", shared_with3="thomas").create()
+        self.assertEqual([w.name for w in Wishlist.find_by_shared_with("isaias")], ["Bea's Wishlist"])
+        self.assertEqual(Wishlist.find_by_shared_with("thomas").count(), 3)
+        records = Wishlist.find_records(Wishlist.find_by_shared_with("becca"))
+        self.assertEqual([r.shared_with for r in records], [["becca", "thomas"], ["thomas", "isaias", "becca"]])
+        self.assertEqual(records[1].shared_with2, "isaias")
+        self.assertEqual(Wishlist.find_by_shared_with("nobody").count(), 0)
+
+    def test_migrate_shares(self):
+        """ Move the shared_with columns of an old database to the share table """
+        db.drop_all()
+        db.session.execute(
+            "CREATE TABLE wishlist (id INTEGER PRIMARY KEY, name VARCHAR(63), email VARCHAR(32), "
+            "shared_with1 VARCHAR(63), shared_with2 VARCHAR(63), shared_with3 VARCHAR(63), "
+            "shared BOOLEAN)"
+        )
+        db.session.execute(
+            "INSERT INTO wishlist VALUES (1, 'home', 'a@b.c', 'x', NULL, 'z', false), "
+            "(2, 'work', 'd@e.f', '', NULL, NULL, false)"
+        )
+        db.session.commit()
+        self.assertEqual(
+            migrations.upgrade(), ["add_wishlist_version", "move_shares_to_table", "create_lookup_indexes"]
+        )
+        self.assertEqual(migrations.upgrade(), [])
+        db.create_all()
+        self.assertEqual(Wishlist.find(1).shared_with, ["x", "z"])
+        self.assertEqual(Wishlist.find(1).shared_with3, "z")
+        self.assertEqual(Wishlist.find(2).shared_with, [])
+        if migrations.can_drop_columns():
+            self.assertNotIn("shared_with1", migrations.columns("wishlist"))
+
+    def test_migrate_baseline(self):
+        """ Upgrade the tables of the first version of the service """
+        db.drop_all()
+        db.session.execute(
+            "CREATE TABLE wishlist (id INTEGER PRIMARY KEY, name VARCHAR(63), email VARCHAR(32), "
+            "shared_with1 VARCHAR(63), shared_with2 VARCHAR(63), shared_with3 VARCHAR(63), shared BOOLEAN)"
+        )
+        db.session.execute(
+            "CREATE TABLE item (id INTEGER PRIMARY KEY, wishlist_id INTEGER NOT NULL REFERENCES wishlist (id), "
+            "name VARCHAR(64), sku VARCHAR(64), description VARCHAR(64), quantity VARCHAR(64))"
+        )
+        db.session.execute("INSERT INTO wishlist VALUES (1, 'home', 'a@b.c', 'x', NULL, NULL, false)")
+        db.session.execute("INSERT INTO item VALUES (1, 1, 'mug', 'A', 'a mug', '2')")
+        db.session.commit()
+        applied = migrations.upgrade()
+        self.assertEqual(applied[:2], ["add_wishlist_version", "move_shares_to_table"])
+        self.assertEqual(migrations.upgrade(), [])
+        db.create_all()
+        self.assertEqual(Wishlist.find_version(1), 1)
+        wishlist = Wishlist.find(1)
+        self.assertEqual((wishlist.shared_with, wishlist.items[0].quantity), (["x"], 2))
+        Wishlist.patch(1, {"name": "house"})
+        self.assertEqual(Wishlist.find_version(1), 2)
+
+    def test_migrate_lookup_indexes(self):
+        """ Index the lookup columns of tables made before the indexes """
+        names = ["ix_item_sku", "ix_item_wishlist_id_name", "ix_wishlist_email", "ix_wishlist_name"]
+        for name in names:
+            db.session.execute("DROP INDEX {}".format(name))
+        db.session.commit()
+        self.assertEqual(migrations.upgrade(), ["create_lookup_indexes"])
+        self.assertEqual(migrations.upgrade(), [])
+        indexes = inspect(db.engine).get_indexes("wishlist") + inspect(db.engine).get_indexes("item")
+        self.assertTrue(set(names) <= {index["name"] for index in indexes})
+
+    def test_migrate_quantity(self):
+        """ Convert the string quantities of an old database to integers """
+        db.drop_all()
+        db.session.execute(
+            "CREATE TABLE item (id INTEGER PRIMARY KEY, wishlist_id INTEGER NOT NULL, name VARCHAR(64), "
+            "sku VARCHAR(64), description VARCHAR(64), quantity VARCHAR(64))"
+        )
+        db.session.execute("CREATE INDEX ix_item_sku ON item (sku)")
+        db.session.execute(
+            "INSERT INTO item VALUES (1, 1, 'mug', 'A', 'a mug', '5'), (2, 1, 'pen', 'B', 'a pen', ' 12 '), "
+            "(3, 1, 'cup', 'C', 'a cup', 'XX'), (4, 1, 'hat', 'D', 'a hat', NULL), (9, 1, 'big', 'E', '', '1234567890')"
+        )
+        db.session.commit()
+        self.assertIn("quantity_to_integer", migrations.upgrade())
+        self.assertNotIn("quantity_to_integer", migrations.upgrade())
+        rows = db.session.query(Item.id, Item.quantity).order_by(Item.id).all()
+        self.assertEqual(rows, [(1, 5), (2, 12), (3, None), (4, None), (9, None)])
+        self.assertEqual(Item.find_by_sku("C").first().name, "cup")
+        self.assertEqual([record.name for record, _ in Item.search("mugs", wishlist_id=1)], ["mug"])
+
+    def test_migrate_rollups(self):
+        """ Count the rows of a database made before the rollup table """
+        wishlist = _create_wishlist(items=[_create_item(), _create_item()])
+        wishlist.create()
+        db.session.remove()
+        Rollup.__table__.drop(db.engine)
+        self.assertEqual(migrations.upgrade(), ["create_rollups"])
+        self.assertEqual(migrations.upgrade(), [])
+        self.assertEqual((Rollup.total("wishlists"), Rollup.total("items")), (1, 2))
+
+    def test_wishlist_version(self):
+        """ Bump the version on every change to a wishlist or its items """
+        wishlist = _create_wishlist()
+        wishlist.create()
+        self.assertEqual(Wishlist.find_version(wishlist.id), 1)
+        wishlist.name = "Renamed"
+        wishlist.save()
+        self.assertEqual(Wishlist.find_version(wishlist.id), 2)
+
+        item = _create_item()
+        item.wishlist_id = wishlist.id
+        Item.create_all([item])
+        self.assertEqual(Wishlist.find_version(wishlist.id), 3)
+        item = Item.find(item.id)
+        item.quantity = 7
+        item.save()
+        self.assertEqual(Wishlist.find_version(wishlist.id), 4)
+        item.delete()
+        self.assertEqual(Wishlist.find_version(wishlist.id), 5)
+        self.assertIsNone(Wishlist.find_version(0))
+
     def test_find_or_404(self):
         """ Find or throw 404 error """
         wishlist = _create_wishlist()
@@ -256,6 +506,37 @@ class TestWishlist(unittest.TestCase):
         wishlists = Wishlist.all()
         self.assertEqual(len(wishlists), 0)
 
+    def test_delete_by_id(self):
+        """ Delete a Wishlist with its items and shares in set-based SQL """
+        wishlist = _create_wishlist(items=[_create_item(), _create_item()])
+        wishlist.create()
+        wishlist_id = wishlist.id
+        item_ids = [item.id for item in wishlist.items]
+        self.assertEqual(sorted(Wishlist.delete_by_id(wishlist_id)), item_ids)
+        self.assertEqual((Wishlist.query.count(), Item.query.count(), Share.query.count()), (0, 0, 0))
+        self.assertEqual(Wishlist.delete_by_id(wishlist_id), [])
+
+    def test_remove_all_rollback(self):
+        """ Keep the rows and the search triggers when a reset fails """
+        if db.engine.dialect.name != "sqlite":
+            self.skipTest("only SQLite drops the search triggers during a reset")
+        wishlist = _create_wishlist(items=[Item(name="mug")])
+        wishlist.create()
+        execute = db.session.execute
+
+        def fail_on_items(statement, *args, **kwargs):
+            if str(statement) == "DELETE FROM item":
+                raise OperationalError(statement, {}, Exception("database is locked"))
+            return execute(statement, *args, **kwargs)
+
+        with patch.object(db.session, "execute", side_effect=fail_on_items):
+            self.assertRaises(OperationalError, Wishlist.remove_all)
+        triggers = db.session.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' ORDER BY name")
+        self.assertEqual([row[0] for row in triggers], sorted(SQLITE_SEARCH_TRIGGERS))
+        self.assertEqual((Wishlist.query.count(), Item.query.count()), (1, 1))
+        Wishlist.remove_all()
+        self.assertEqual(Item.query.count(), 0)
+
     def test_share_wishlist(self):
         """ Share a wishlist """
         wishlist = _create_wishlist()
@@ -273,6 +554,29 @@ class TestWishlist(unittest.TestCase):
         # Fetch it back again
         wishlist = Wishlist.find(wishlist.id)
         self.assertEqual(wishlist.shared, True)
+
+    def test_toggle_shared(self):
+        """ Toggle the shared flag in SQL """
+        wishlist = _create_wishlist()
+        wishlist.create()
+        db.session.execute(Wishlist.__table__.update().values(shared=None))
+        record = Wishlist.toggle_shared(wishlist.id)
+        self.assertEqual(record.shared, True)
+        self.assertEqual(Wishlist.toggle_shared(wishlist.id).shared, False)
+        self.assertEqual(Wishlist.find_version(wishlist.id), 3)
+        self.assertIsNone(Wishlist.toggle_shared(0))
+
+    def test_patch_wishlist(self):
+        """ Update only the given fields of a Wishlist """
+        wishlist = _create_wishlist()
+        wishlist.create()
+        record = Wishlist.patch(wishlist.id, {"email": "new@stern.nyu.edu"})
+        self.assertEqual(record.as_dict(), {
+            "id": wishlist.id, "name": wishlist.name, "email": "new@stern.nyu.edu", "shared": wishlist.shared
+        })
+        self.assertIsNone(Wishlist.patch(0, {"name": "x"}))
+        self.assertRaises(DataValidationError, Wishlist.patch, wishlist.id, {"version": 9})
+        self.assertRaises(DataValidationError, Item.patch, wishlist.id, 1, "quantity")
         
 ######################################################################
 #  I T E M   M O D E L   T E S T   C A S E S
@@ -314,14 +618,14 @@ class TestItem(unittest.TestCase):
             name="DevOps Final Grade", 
             sku="A+", 
             description="Final Grade for DevOps Class", 
-            quantity="5" 
+            quantity=5
         )
         self.assertTrue(item != None)
         self.assertEqual(item.id, None)
         self.assertEqual(item.name, "DevOps Final Grade")
         self.assertEqual(item.sku, "A+")
         self.assertEqual(item.description, "Final Grade for DevOps Class")
-        self.assertEqual(item.quantity, "5")
+        self.assertEqual(item.quantity, 5)
 
     def test_find_or_404(self):
         """ Find item or throw 404 error """
@@ -362,13 +666,156 @@ class TestItem(unittest.TestCase):
         old_item = wishlist.items[0]
         self.assertEqual(old_item.quantity, item.quantity)
 
-        old_item.quantity = "XX"
+        old_item.quantity = 10
         wishlist.save()
 
         # Fetch it back again
         wishlist = Wishlist.find(wishlist.id)
         item = wishlist.items[0]
-        self.assertEqual(item.quantity, "XX")
+        self.assertEqual(item.quantity, 10)
+
+    def test_parse_quantity(self):
+        """ Accept whole numbers, and the digit strings older clients send """
+        self.assertEqual(Item.parse_quantity(3), 3)
+        self.assertEqual(Item.parse_quantity(" 12 "), 12)
+        self.assertIsNone(Item.parse_quantity(None))
+        for value in ("XX", "", -1, 1.5, True, Item.MAX_QUANTITY + 1):
+            self.assertRaises(DataValidationError, Item.parse_quantity, value)
+
+    def test_totals(self):
+        """ Total the Items of each Wishlist and each email in the database """
+        for email, quantities in (("a@b.c", [2, 3]), ("a@b.c", []), ("d@e.f", [None, 7])):
+            wishlist = Wishlist(name="home", email=email)
+            wishlist.items = [Item(name="mug", quantity=quantity) for quantity in quantities]
+            wishlist.create()
+        totals = [tuple(row) for row in Item.totals_by_wishlist()]
+        self.assertEqual(totals, [(1, 2, 5), (2, 0, 0), (3, 2, 7)])
+        totals = [row._asdict() for row in Item.totals_by_email()]
+        self.assertEqual(totals, [
+            {"email": "a@b.c", "wishlists": 2, "items": 2, "quantity": 5},
+            {"email": "d@e.f", "wishlists": 1, "items": 2, "quantity": 7},
+        ])
+        self.assertEqual([row.wishlist_id for row in Item.totals_by_wishlist("d@e.f")], [3])
+
+    def test_search(self):
+        """ Search the names and descriptions of Items, best match first """
+        for email, shared, items in (
+                ("a@b.c", True, [("Ceramic mug", "a ceramic mug"), ("Mugs", "two steel mugs"), ("Pen", "ceramic")]),
+                ("a@b.c", False, [("Ceramic mug", None)]),
+                ("d@e.f", True, [("Plate", "a ceramic plate")])):
+            wishlist = Wishlist(name="home", email=email, shared=shared)
+            wishlist.items = [Item(name=name, description=description) for name, description in items]
+            wishlist.create()
+
+        def ids(text, **kwargs):
+            return [record.id for record, _ in Item.search(text, **kwargs)]
+
+        self.assertEqual(ids("ceramic mug"), [1])
+        self.assertEqual(sorted(ids("mugs")), [1, 2])
+        self.assertEqual(sorted(ids("ceramic")), [1, 3, 5])
+        self.assertEqual(sorted(ids("ceramic", email="a@b.c")), [1, 3, 4])
+        self.assertEqual(ids("ceramic", wishlist_id=2), [4])
+        self.assertEqual(ids('"mug" OR pen*'), [])
+        self.assertRaises(DataValidationError, Item.search, "  !? ")
+        # pages follow each other by (rank, id)
+        matches = [(record.id, rank) for record, rank in Item.search("ceramic", email="a@b.c")]
+        self.assertEqual(matches, sorted(matches, key=lambda match: (match[1], match[0])))
+        rest = Item.search("ceramic", email="a@b.c", after=(matches[0][1], matches[0][0]))
+        self.assertEqual([(record.id, rank) for record, rank in rest], matches[1:])
+        Item.find(1).delete()
+        self.assertEqual(ids("ceramic mug"), [])
+
+    def test_rollups(self):
+        """ Keep the statistics counts in step with every write """
+        def counts():
+            return sorted((row.kind, row.name, row.count) for row in Rollup.query.filter(Rollup.count != 0))
+
+        home = Wishlist(name="home", email="a@b.c")
+        home.items = [Item(name="mug", sku="A"), Item(name="pen", sku="B")]
+        home.create()
+        work = Wishlist(name="work", email="a@b.c")
+        work.create()
+        Item.create_all([Item(wishlist_id=work.id, name="cup", sku="A")])
+        work = Wishlist.find(work.id)
+        work.email = "d@e.f"
+        work.items.append(Item(name="hat", sku="C"))
+        work.save()
+        Wishlist.patch(home.id, {"email": "g@h.i"})
+        Item.patch(home.id, home.items[1].id, {"sku": "A"})
+        home.items[0].delete()
+        self.assertEqual(Rollup.total("wishlists"), 2)
+        self.assertEqual(Rollup.total("items"), 3)
+        self.assertEqual(Rollup.top(Rollup.SKU, 1), [("A", 2)])
+        live = counts()
+        Rollup.rebuild()
+        self.assertEqual(live, counts())
+
+        Wishlist.delete_by_id(work.id)
+        Wishlist.find(home.id).delete()
+        self.assertEqual(counts(), [])
+
+    def test_rollup_lock_order(self):
+        """ Upsert the counts in key order, whatever order they changed in """
+        deltas = Counter({(Rollup.SKU, "B"): 1, (Rollup.TOTAL, "items"): 1, (Rollup.SKU, "A"): -1})
+        with patch.object(db.session, "execute") as execute:
+            Rollup.adjust(deltas)
+        rows = execute.call_args[0][1]
+        self.assertEqual([(row["kind"], row["name"]) for row in rows], [("sku", "A"), ("sku", "B"), ("total", "items")])
+
+    def test_create_all_items(self):
+        """ Create a batch of items with one statement """
+        wishlist = _create_wishlist()
+        wishlist.create()
+        items = [_create_item() for _ in range(3)]
+        for item in items:
+            item.wishlist_id = wishlist.id
+        Item.create_all(items)
+        self.assertEqual([item.id for item in items], [1, 2, 3])
+        wishlist = Wishlist.find(wishlist.id)
+        self.assertEqual(
+            [item.name for item in wishlist.items], [item.name for item in items]
+        )
+        self.assertEqual(Item.create_all([]), [])
+
+    def test_find_items_by_wishlist(self):
+        """ Find the items of a wishlist by name and sku """
+        wishlist = _create_wishlist()
+        wishlist.create()
+        items = []
+        for name, sku in [("Mug", "1"), ("mug", "2"), ("Mugs", "1"), ("Mux", "1")]:
+            items.append(Item(wishlist_id=wishlist.id, name=name, sku=sku))
+        Item.create_all(items)
+
+        def names(**kwargs):
+            query = Item.find_by_wishlist(wishlist.id, **kwargs)
+            return [item.name for item in Item.find_page(query)]
+
+        self.assertEqual(names(), ["Mug", "mug", "Mugs", "Mux"])
+        self.assertEqual(names(name="mug"), ["mug"])
+        self.assertEqual(names(name="mUG", match="icase"), ["Mug", "mug"])
+        self.assertEqual(names(name="Mug", match="prefix"), ["Mug", "Mugs"])
+        self.assertEqual(names(name="Mu", match="prefix", sku="1"), ["Mug", "Mugs", "Mux"])
+        self.assertEqual(names(name="x", match="prefix"), [])
+        self.assertRaises(DataValidationError, Item.find_by_wishlist, wishlist.id, "Mug", "regex")
+
+    def test_find_items_by_prefix(self):
+        """ Match name prefixes literally, whatever characters they hold """
+        wishlist = _create_wishlist()
+        wishlist.create()
+        names = ["50% off", "50 percent", "a_b", "axb", "a*b", "a[b]", "ab", "cup\ud7ff", "cup\U0010ffff"]
+        Item.create_all([Item(wishlist_id=wishlist.id, name=name) for name in names])
+
+        def prefixed(prefix):
+            query = Item.find_by_wishlist(wishlist.id, name=prefix, match="prefix")
+            return [item.name for item in Item.find_page(query)]
+
+        self.assertEqual(prefixed("50%"), ["50% off"])
+        self.assertEqual(prefixed("a_"), ["a_b"])
+        self.assertEqual(prefixed("a*"), ["a*b"])
+        self.assertEqual(prefixed("a["), ["a[b]"])
+        self.assertEqual(prefixed("a?"), [])
+        self.assertEqual(prefixed("cup\ud7ff"), ["cup\ud7ff"])
+        self.assertEqual(prefixed("cup\U0010ffff"), ["cup\U0010ffff"])
 
     #@classmethod
     def test_delete_wishlist_item(self):
@@ -0,0 +1,80 @@
+"""
+Test cases for the connection pool telemetry
+
+"""
+import os
+import sqlite3
+import unittest
+from unittest.mock import Mock
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import QueuePool
+from service import pool
+from service.pool import InstrumentedQueuePool, WaitHistogram, pool_stats
+
+
+######################################################################
+#  P O O L   T E S T   C A S E S
+######################################################################
+class TestPoolTelemetry(unittest.TestCase):
+    """ Test Cases for the instrumented connection pool """
+
+    def setUp(self):
+        pool.wait_times.reset()
+
+    def test_histogram_buckets(self):
+        """ Count observations in cumulative buckets """
+        histogram = WaitHistogram(buckets=(1, 10))
+        histogram.observe(0.5)
+        histogram.observe(5)
+        histogram.observe(50, timed_out=True)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["buckets"], {"1": 1, "10": 2, "+Inf": 3})
+        self.assertEqual(snapshot["count"], 3)
+        self.assertEqual(snapshot["sum_ms"], 55.5)
+        self.assertEqual(snapshot["timeouts"], 1)
+
+    def test_instrumented_pool(self):
+        """ Record checkouts and timeouts of a QueuePool """
+        engine = create_engine(
+            "sqlite://",
+            poolclass=InstrumentedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.05,
+            creator=lambda: sqlite3.connect(":memory:", check_same_thread=False),
+        )
+        connection = engine.connect()
+        stats = pool_stats(engine)
+        self.assertEqual(stats["pool"], "InstrumentedQueuePool")
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["checked_out"], 1)
+        self.assertEqual(stats["overflow"], 0)
+
+        self.assertRaises(exc.TimeoutError, engine.connect)
+        connection.close()
+        stats = pool_stats(engine)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["wait"]["count"], 2)
+        self.assertEqual(stats["wait"]["timeouts"], 1)
+        self.assertGreaterEqual(stats["wait"]["sum_ms"], 50)
+
+    def test_inherited_connection(self):
+        """ Never check out a connection opened by another process """
+        engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=1, max_overflow=0)
+        connection = engine.connect()
+        inherited = connection.connection.connection
+        connection.connection._connection_record.info["pid"] = -1  # as if opened before a fork
+        connection.close()
+        connection = engine.connect()
+        self.assertIsNot(connection.connection.connection, inherited)
+        self.assertEqual(connection.connection._connection_record.info["pid"], os.getpid())
+        connection.close()
+
+    def test_init_app(self):
+        """ Only swap the pool class when pool options are configured """
+        app = Mock(config={"SQLALCHEMY_ENGINE_OPTIONS": {"pool_size": 5}})
+        pool.init_app(app)
+        self.assertIs(app.config["SQLALCHEMY_ENGINE_OPTIONS"]["poolclass"], InstrumentedQueuePool)
+        app = Mock(config={})
+        pool.init_app(app)
+        self.assertEqual(app.config["SQLALCHEMY_ENGINE_OPTIONS"], {})
@@ -0,0 +1,73 @@
+"""
+Test cases for the fast serializers
+
+"""
+import unittest
+from collections import namedtuple
+from unittest.mock import patch
+from flask import jsonify
+from service import app, serializers
+from service.models import Wishlist, Item
+from service.serializers import ITEM_FIELDS, serialize_item, serialize_wishlist, json_response
+
+PAYLOADS = [
+    [{"id": 1, "name": "mug", "shared": True, "items": [], "email": None}],
+    {"name": "café   \U0001F600"},
+    {"name": "tab\tnull\x00del\x7f\"quote\" back\\slash </script>"},
+    {"id": 2 ** 70},
+    [],
+]
+
+
+######################################################################
+#  S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+class TestSerializers(unittest.TestCase):
+    """ Test Cases for byte compatible serialization """
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def assert_same_bytes(self, payload):
+        self.assertEqual(
+            json_response(payload, 200).get_data(), jsonify(payload).get_data(), payload
+        )
+
+    def test_same_bytes_as_jsonify(self):
+        """ Encode exactly like jsonify """
+        for payload in PAYLOADS:
+            self.assert_same_bytes(payload)
+
+    def test_same_bytes_without_orjson(self):
+        """ Encode exactly like jsonify with the stdlib fallback """
+        with patch.object(serializers, "orjson", None):
+            for payload in PAYLOADS:
+                self.assert_same_bytes(payload)
+
+    def test_same_bytes_without_ascii(self):
+        """ Encode exactly like jsonify when JSON_AS_ASCII is off """
+        with patch.dict(app.config, {"JSON_AS_ASCII": False}):
+            for payload in PAYLOADS:
+                self.assert_same_bytes(payload)
+
+    def test_response(self):
+        """ Set the status, headers and mimetype of the response """
+        response = json_response({"id": 1}, 201, {"Location": "/wishlists/1"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.headers["Location"], "/wishlists/1")
+        self.assertEqual(response.mimetype, "application/json")
+
+    def test_serialize_rows(self):
+        """ Serialize rows and model instances alike """
+        row = namedtuple("Row", ITEM_FIELDS)(7, 3, "mug", "ABC", "a mug", 2)
+        item = Item(id=7, wishlist_id=3, name="mug", sku="ABC", description="a mug", quantity=2)
+        self.assertEqual(serialize_item(row), item.serialize())
+        wishlist = Wishlist(id=3, name="home", email="a@b.c", shared=False)
+        message = serialize_wishlist(wishlist, [row])
+        self.assertEqual(message["items"], [item.serialize()])
+        self.assertEqual(message["name"], "home")
+        self.assertIsNone(message["shared_with1"])
@@ -0,0 +1,44 @@
+"""
+Test cases for the request timing breakdown
+
+"""
+import unittest
+from unittest.mock import MagicMock
+from service import timing
+from service.timing import RequestTiming, measure
+
+
+######################################################################
+#  T I M I N G   T E S T   C A S E S
+######################################################################
+class TestRequestTiming(unittest.TestCase):
+    """ Test Cases for the Server-Timing breakdown """
+
+    def test_header(self):
+        """ Format the collected timings as a Server-Timing header """
+        request_timing = RequestTiming()
+        request_timing.queries = 2
+        request_timing.add("db", 0.0015)
+        request_timing.add("db", 0.0005)
+        request_timing.add("json", 0.00025)
+        self.assertEqual(
+            request_timing.header(3.5),
+            'db;dur=2.0;desc="2 queries", json;dur=0.25, total;dur=3.5',
+        )
+
+    def test_measure_outside_request(self):
+        """ Measure nothing outside of a request """
+        self.assertIsNone(timing.current_timing())
+        with measure("serialize"):
+            value = 1
+        self.assertEqual(value, 1)
+
+    def test_failed_query_start(self):
+        """ Leave nothing behind on the connection for a statement that failed """
+        conn = MagicMock(info={})
+        args = (conn, None, "SELECT 1", (), None, False)
+        # the first statement raises, so after_cursor_execute never runs
+        timing._before_cursor_execute(*args)
+        timing._before_cursor_execute(*args)
+        timing._after_cursor_execute(*args)
+        self.assertEqual(conn.info, {})